@@ -1,12 +1,18 @@
 # Loading the VSG ARB module with a custom waveform
+# The waveform library (wfm_library.yaml) is designed in parallel, cached on the disk,
+# and only the waveforms that are not in the VSG memory are downloaded.
 import pyarbtools as arb
 
+from o221_wfm_cache import WaveformCache
+from o223_wfm_library import read_manifest, build_library, load_library
+
 # Test the function
 if __name__ == '__main__':
-    # Generate an iqdata signal
-    iqdata = ...
-    name = 'name_of_signal'
-    Fs      = 20e6 # Hz Sampling frequency
+    # Generate the iqdata signals of the library (designed only if not in the disk cache)
+    manifest = read_manifest("wfm_library.yaml")
+    library  = build_library(manifest, max_workers=manifest.get('MaxWorkers'))
+    name     = next(iter(library))
+    Fs       = manifest['Fs']*1e6 # Hz Sampling frequency
 
     # Create ARB object
     mxg_ip  = '10.0.0.14'
@@ -14,12 +20,12 @@ if __name__ == '__main__':
     # Generate
     sigarb  = arb.instruments.VSG(mxg_ip, timeout=3)
     sigarb.configure(fs=Fs, iqScale=70 )
-    sigarb.download_wfm(iqdata, wfmID='name')
+    # Download the waveforms missing in the VSG memory (one session)
+    wfm_cache = WaveformCache(sigarb)
+    wfm_ids   = load_library(wfm_cache, library)
 
     sigarb.set_cf(1e9)
     sigarb.set_fs(Fs)
     sigarb.set_alcState(0)
 
-    sigarb.play(name)
-
-
+    sigarb.play(wfm_ids[name])
@@ -9,9 +9,13 @@ import pyarbtools as arb
 import yaml
 from PyQt6.QtWidgets import QApplication, QMainWindow
 from PyQt6.uic import loadUi
+from PyQt6.QtCore import QTimer
 
 from python_rf_course_utils.qt import h_gui
-from python_rf_course_utils.arb import multitone
+
+from o218_mutitone import multitone_cached
+from o221_wfm_cache import WaveformCache
+from o222_arb_worker import ArbWorker
 
 def is_valid_ip(ip:str) -> bool:
     # Regular expression pattern for matching IP address
@@ -50,7 +54,12 @@ class LabDemoMxgControl(QMainWindow):
         self.rm         = pyvisa.ResourceManager('@py')
         self.sig_gen    = None
         self.arb_gen    = None
-
+        self.wfm_cache  = None
+        self.arb_worker = None
+        # Debounce of the multi-tone settings, the waveform is updated once the dial/spin box stops changing
+        self.multitone_timer = QTimer()
+        self.multitone_timer.setSingleShot(True)
+        self.multitone_timer.timeout.connect(self.cb_multitone_submit)
 
         # Load the configuration/default values from the YAML file
         self.Params     = None
@@ -207,6 +216,13 @@ class LabDemoMxgControl(QMainWindow):
                 mxg_ip         = self.h_gui['IP'].get_val()
                 self.arb_gen    = arb.instruments.VSG(mxg_ip, timeout=3)
                 self.arb_gen.configure(fs=self.Params['ArbNaxFs']*1e6, iqScale=70 )
+                # Waveforms already in the ARB memory are played without a download
+                self.wfm_cache  = WaveformCache(self.arb_gen, max_samples=self.Params.get('ArbMemSamples', 8_000_000))
+                # Design, download and play in the background (the GUI thread does not wait for the ARB)
+                self.arb_worker = ArbWorker(self.wfm_cache, design=self.multitone_design, prefix='RfLabMultiTone')
+                self.arb_worker.log.connect(print)
+                self.arb_worker.playing.connect(lambda name: print(f"Playing {name}"))
+                self.arb_worker.start()
                 # Clear Errors
                 self.sig_gen_write('*CLS')
                 # Set the Auto Level Control to Off (ALC)
@@ -220,28 +236,51 @@ class LabDemoMxgControl(QMainWindow):
                 print(f"Error: {e}")
                 self.h_gui['Mod_On_Off'].set_val(False, is_callback=True)
                 self.h_gui['RF_On_Off' ].set_val(False, is_callback=True)
+                self.stop_arb_worker()
                 if self.arb_gen is not None:
                     self.arb_gen = None
+                    self.wfm_cache = None
                 # Clear Button state
                 self.sender().setChecked(False)
         else:
             print("MultiTone Off")
+            # The worker must not use the ARB after it is stopped
+            self.stop_arb_worker()
             if self.arb_gen is not None:
                 self.arb_gen.stop()
                 self.arb_gen = None
+                self.wfm_cache = None
             self.h_gui['Mod_On_Off'].set_val(False, is_callback=False)
 
     def cb_multitone_update(self):
         print(f"MultiTone Bandwidth = {self.h_gui['MultiToneBw'].get_val()} MHz")
         print(f"MultiTone Number of Tones = {self.h_gui['MultiToneNtones'].get_val()}")
-        if self.arb_gen is not None:
-            sig = multitone(BW=self.h_gui['MultiToneBw'].get_val(), Ntones=self.h_gui['MultiToneNtones'].get_val(),
-                            Fs=self.Params['ArbNaxFs'], Nfft=2048)
-            self.arb_gen.download_wfm(sig, wfmID='RfLabMultiTone')
-            self.arb_gen.play('RfLabMultiTone')
+        if self.arb_worker is not None:
+            # (Re)start the debounce, rapid changes collapse into the last one
+            self.multitone_timer.start(self.Params.get('MultiToneDebounceMs', 150))
+
+    def cb_multitone_submit(self):
+        # The settings stopped changing, the worker replaces any pending request with this one
+        if self.arb_worker is not None:
+            self.arb_worker.submit(BW=self.h_gui['MultiToneBw'].get_val(),
+                                   Ntones=self.h_gui['MultiToneNtones'].get_val())
+
+    def multitone_design(self, BW, Ntones):
+        # Designed once per setting (LRU cache), deterministic phases of a low crest factor (worker thread)
+        sig, _, _ = multitone_cached(BW=BW, Ntones=Ntones, Fs=self.Params['ArbNaxFs'], Nfft=2048,
+                                     phase=self.Params.get('MultiTonePhase', 'newman'))
+        return sig
+
+    def stop_arb_worker(self):
+        self.multitone_timer.stop()
+        if self.arb_worker is not None:
+            self.arb_worker.stop()
+            self.arb_worker.wait()
+            self.arb_worker = None
 
     def closeEvent(self, event):
         print("Exiting the application")
+        self.stop_arb_worker()
         # Clean up the resources
         # Close the connection to the signal generator
         if self.sig_gen is not None:
@@ -2,11 +2,102 @@
 # BW (bandwidth) Ntones (Number of tones) Fs (Sampling frequency) Nfft (FFT size)
 # The function will design in the frequency domain and returns the multi-tone time domain signal.
 # Thus, creating a multi-tone periodic signal in the time domain.
+# multitone_cached() - the same design with deterministic phases (Newman or Schroeder, low crest factor),
+# the waveforms are kept in an LRU cache, thus going back to a previous setting does not design it again.
+# phase='cfr' - crest factor reduction, the Newman phases are improved by iterative clipping and filtering,
+# the lower PAPR leaves more of the ARB scaling (iqScale) to the signal.
 
+from functools import lru_cache
+from time import perf_counter
 from typing import Tuple
 import numpy as np
 
-def mutitone(BW: float, Ntones: int, Fs: float, Nfft: int = 4096)->Tuple[np.ndarray, np.ndarray, np.ndarray]:
+PHASE_POLICIES = ('random', 'zero', 'newman', 'schroeder', 'cfr')
+
+def papr_db(x: np.ndarray) -> float:
+    # Peak to average power ratio (dB)
+    p = np.abs(x) ** 2
+    return 10 * np.log10(np.max(p) / np.mean(p))
+
+def crest_factor_phases(bin_index: np.ndarray, phi: np.ndarray, Nfft: int, target_papr_db: float = 2.0,
+                        max_iter: int = 50, max_points: int = 2 ** 19, max_time: float = 0.05,
+                        oversample: int = 2, log=None) -> np.ndarray:
+    '''
+    Crest factor reduction of a multi-tone by iterative clipping and filtering.
+    Every iteration clips the time domain signal to the target PAPR and restores the tones in the
+    frequency domain (unit magnitude, the phase of the clipped signal, nothing outside the tones).
+    The iterations run on the smallest FFT that holds the tones (oversampled), not on the Nfft grid,
+    it is the same periodic signal at a lower rate, with preallocated single precision buffers.
+    The number of iterations depends only on the arguments (max_iter and max_points), never on the
+    run time, thus the phases are deterministic (cached and found in the ARB memory by their hash).
+    :param bin_index: Bin of every tone (DC bin at Nfft//2, as in mutitone)
+    :param phi: Initial phases (e.g. Newman)
+    :param Nfft: FFT size of the waveform
+    :param target_papr_db: Stop when the PAPR is at or below it
+    :param max_iter: Iteration budget
+    :param max_points: FFT budget (sum of the FFT sizes of all the iterations), limits the iterations of
+                       large grids (8 iterations of a 65536 grid). It is a work budget, not a time guarantee,
+                       ~45 ms on a desktop, longer on a slower or loaded CPU (e.g. in a process pool).
+    :param max_time: Time guard (sec), only reported when exceeded - it does not change the result
+    :param oversample: Oversampling of the tone span (PAPR accuracy of the iterations)
+    :param log: Callable receiving the time guard report (e.g. logger.warning), None - not reported
+    :return: phi - the phases of the lowest PAPR found
+    '''
+    t_start = perf_counter()
+    # Tone bins in FFT order of the reduced grid (power of 2, at most Nfft)
+    k       = np.asarray(bin_index) - Nfft // 2
+    span    = 2 * int(np.max(np.abs(k))) + 1
+    M       = int(min(Nfft, 2 ** int(np.ceil(np.log2(oversample * span)))))
+    bins    = k % M
+    n_iter  = max(1, min(max_iter, max_points // M))
+    # The tones have unit magnitude, thus the mean power of the signal is constant
+    rms     = np.sqrt(len(k)) / M
+    level   = rms * 10 ** (target_papr_db / 20)
+    # Preallocated buffers
+    X       = np.zeros(M, dtype=np.complex64)
+    x       = np.empty(M, dtype=np.complex64)
+    mag     = np.empty(M, dtype=np.float32)
+    best    = (np.inf, np.asarray(phi, dtype=float))
+    for _ in range(n_iter):
+        X[bins] = np.exp(1j * phi)
+        np.fft.ifft(X, out=x)
+        np.abs(x, out=mag)
+        papr    = 20 * np.log10(mag.max() / rms)
+        if papr < best[0]:
+            best = (papr, phi)
+        if papr <= target_papr_db:
+            break
+        # Clip the magnitude to the target level (the phase is kept)
+        np.maximum(mag, level, out=mag)
+        np.divide(level, mag, out=mag)
+        x      *= mag
+        # Restore the tones, keep their phases
+        phi     = np.angle(np.fft.fft(x, out=x)[bins]).astype(float)
+    t_elapsed = perf_counter() - t_start
+    if t_elapsed > max_time and log is not None:
+        log(f"Crest factor reduction took {t_elapsed*1e3:.0f} ms ({n_iter} iterations of {M} points)")
+    return best[1]
+
+def multitone_phases(Ntones: int, phase: str = 'random') -> np.ndarray:
+    '''
+    Phases of the tones
+    :param Ntones: Number of tones
+    :param phase: 'random' - uniform random, 'zero' - all zero (worst crest factor),
+                  'newman' - pi*k^2/N, 'schroeder' - pi*k*(k+1)/N (k = 0..N-1, both low crest factor)
+    :return: phi - phase (rad) of every tone
+    '''
+    k = np.arange(Ntones)
+    if phase == 'random':
+        return np.random.rand(Ntones) * 2 * np.pi
+    if phase == 'zero':
+        return np.zeros(Ntones)
+    if phase == 'newman':
+        return np.pi * k**2 / Ntones
+    if phase == 'schroeder':
+        return np.pi * k * (k + 1) / Ntones
+    raise ValueError(f"Unknown phase policy: {phase} (one of {PHASE_POLICIES})")
+
+def mutitone(BW: float, Ntones: int, Fs: float, Nfft: int = 4096, phase: str = 'random')->Tuple[np.ndarray, np.ndarray, np.ndarray]:
     '''
     Design a multi-tone signal in the frequency domain and return the time domain signal.
     Flat amplitude symmetrical around DC.
@@ -14,27 +105,43 @@ def mutitone(BW: float, Ntones: int, Fs: float, Nfft: int = 4096)->Tuple[np.ndar
     :param Ntones:
     :param Fs:
     :param Nfft:
+    :param phase: Phase policy of the tones (see multitone_phases), 'cfr' - crest factor reduced Newman phases
     :return: x - Periodic time domain multi-tone signal, X - frequency domain, F - Frequency vector
     '''
     # Generate the frequency vector (symmetric around DC)
     f = np.linspace(-BW / 2, BW / 2, Ntones)
     # Generate the amplitude vector
     A = np.ones(Ntones)
-    # Generate a random phase vector
-    phi = np.random.rand(Ntones) * 2 * np.pi
+    # Bin index of every tone (frequency f rounded to the nearest bin) while the DC bin is at the center
+    bin_index = np.round(f / Fs * Nfft).astype(int) + Nfft // 2
+    # Generate the phase vector
+    if phase == 'cfr':
+        phi = crest_factor_phases(bin_index, multitone_phases(Ntones, 'newman'), Nfft)
+    else:
+        phi = multitone_phases(Ntones, phase)
     # Initialize the frequency domain vector to zeros
     X = np.zeros(Nfft, dtype=complex)
-    # Generate the frequency domain signal (with frequency f rounded to the nearest bin)
-    for i in range(Ntones):
-        # Calculate the bin index for the frequency f[i] whie the DC bin is at the center
-        bin_index = int(np.round(f[i] / Fs * Nfft)) + Nfft // 2
-        # Set the amplitude and phase
-        X[bin_index] = A[i] * np.exp(1j * phi[i])
+    # Set the amplitude and phase of all the tones at once (fancy indexing)
+    X[bin_index] = A * np.exp(1j * phi)
     # Generate the time domain signal
     x = np.fft.ifft(np.fft.ifftshift(X))
     F = -Fs / 2 + Fs / Nfft * np.arange(Nfft)
     return x / np.max(np.abs(x)) , X , F
 
+@lru_cache(maxsize=32)
+def multitone_cached(BW: float, Ntones: int, Fs: float, Nfft: int = 4096, phase: str = 'newman')->Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    '''
+    mutitone() with an LRU cache keyed by (BW, Ntones, Fs, Nfft, phase)
+    The phases must be deterministic (not 'random'), thus a cached waveform is the one the settings define.
+    The returned arrays are shared by all the callers and are read only (copy before changing them).
+    '''
+    if phase == 'random':
+        raise ValueError("Random phases can not be cached, use mutitone()")
+    x, X, F = mutitone(BW, Ntones, Fs, Nfft, phase)
+    for a in (x, X, F):
+        a.flags.writeable = False
+    return x, X, F
+
 # Test the function
 if __name__ == '__main__':
     import matplotlib.pyplot as plt
@@ -0,0 +1,138 @@
+# Cache of the waveforms in the ARB memory of the signal generator
+# A download of a waveform takes seconds over the network (2048 to 1M samples), a play of a waveform
+# that is already in the memory takes milliseconds.
+# The waveforms are named by a hash of their content (prefix_hash), thus a waveform already in the memory
+# is found by its name - also one downloaded by an earlier session (the catalog of the volatile memory
+# is read when the cache is created) - and is played without downloading it again.
+# When the memory is full (memory full error of the instrument), the least recently used waveforms are deleted.
+# Also used by the workshop PA app (Exercises/workshop/solution/pa_app_solution.py).
+
+import re
+import hashlib
+
+from collections import OrderedDict
+
+import numpy as np
+
+# Memory full error of the instrument (SCPI -225 "Out of memory")
+MEMORY_FULL = re.compile(r'-225\b|out of memory|memory full|insufficient memory', re.IGNORECASE)
+
+
+def wfm_hash(wfm: np.ndarray) -> str:
+    '''
+    Content hash of a waveform (samples, dtype and length)
+    :return: 16 hex digits
+    '''
+    wfm = np.ascontiguousarray(wfm)
+    h   = hashlib.blake2b(digest_size=8)
+    h.update(f"{wfm.dtype.str}{wfm.shape}".encode())
+    h.update(wfm.view(np.uint8))
+    return h.hexdigest()
+
+
+class WaveformCache:
+    '''
+    Download a waveform only if it is not in the ARB memory yet
+    cache = WaveformCache(arb_gen)                  # pyarbtools VSG object
+    cache.play(sig, prefix='RfLabMultiTone')        # download (first time) and play
+    :param arb: pyarbtools instrument (download_wfm, play, delete_wfm)
+    :param max_samples: Waveform memory of the instrument (samples), the LRU waveforms are deleted beyond it
+    :param sync: Read the catalog of the volatile waveform memory (waveforms of an earlier session)
+    :param max_retries: Downloads retried after a memory full error (one LRU waveform deleted before each)
+    '''
+    def __init__(self, arb, max_samples: int = 8_000_000, sync: bool = True, max_retries: int = 3):
+        self.arb            = arb
+        self.max_samples    = max_samples
+        self.max_retries    = max_retries
+        self.loaded         = OrderedDict() # Waveform ID -> number of samples (least recently used first)
+        self.playing        = None          # Waveform ID being played
+        self.n_downloads    = 0
+        if sync:
+            self.sync()
+
+    @staticmethod
+    def wfm_id(wfm: np.ndarray, prefix: str) -> str:
+        # Name of the waveform in the memory
+        return f"{prefix}_{wfm_hash(wfm)}"
+
+    def sync(self):
+        '''
+        Read the waveforms in the volatile memory (WFM1), the ones named by a content hash are cached
+        The catalog is '<used>,<free>,"<name>,<type>,<size>",...', on failure the cache starts empty.
+        '''
+        try:
+            catalog = self.arb.query('MMEMory:CATalog? "WFM1:"')
+        except Exception as e:
+            print(f"Waveform catalog not read: {e}")
+            return
+        for name, size in re.findall(r'"([^",]+_[0-9a-fA-F]{16}),[^",]*,(\d+)"', catalog):
+            # 4 bytes per IQ sample (int16 I and Q)
+            self.loaded[name] = int(size)//4
+
+    def n_samples(self) -> int:
+        return sum(self.loaded.values())
+
+    def is_memory_full(self, err: Exception) -> bool:
+        '''
+        A download failed on a memory full error - by the exception message or confirmed by the
+        error queue of the instrument (any other failure, e.g. a socket timeout, is not)
+        '''
+        if MEMORY_FULL.search(str(err)):
+            return True
+        try:
+            return MEMORY_FULL.search(self.arb.query('SYST:ERR?')) is not None
+        except Exception:
+            return False
+
+    def evict(self) -> bool:
+        '''
+        Delete the least recently used waveform (not the one being played)
+        :return: False if there is nothing to delete
+        '''
+        for name in self.loaded:
+            if name != self.playing:
+                del self.loaded[name]
+                self.arb.delete_wfm(name)
+                return True
+        return False
+
+    def load(self, wfm: np.ndarray, prefix: str = 'wfm') -> str:
+        '''
+        Download the waveform if it is not in the memory
+        :return: Waveform ID (name in the memory)
+        '''
+        name = self.wfm_id(wfm, prefix)
+        if name in self.loaded:
+            self.loaded.move_to_end(name)
+            return name
+
+        # Make room for the waveform
+        while self.loaded and self.n_samples() + len(wfm) > self.max_samples and self.evict():
+            pass
+        for retry in range(self.max_retries + 1):
+            try:
+                self.arb.download_wfm(wfm, wfmID=name)
+                break
+            except Exception as e:
+                # Memory full (e.g. other waveforms in it), delete the LRU waveform and try again
+                if retry == self.max_retries or not self.is_memory_full(e) or not self.evict():
+                    raise
+        self.n_downloads   += 1
+        self.loaded[name]   = len(wfm)
+        return name
+
+    def play(self, wfm: np.ndarray, prefix: str = 'wfm') -> str:
+        '''
+        Play the waveform, downloaded only if it is not in the memory
+        :return: Waveform ID
+        '''
+        name = self.load(wfm, prefix)
+        if name != self.playing:
+            self.arb.play(name)
+            self.playing = name
+        return name
+
+    def clear(self):
+        # The memory was changed by others (e.g. power cycle), forget the cached waveforms
+        self.loaded.clear()
+        self.playing = None
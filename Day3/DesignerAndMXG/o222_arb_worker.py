@@ -0,0 +1,67 @@
+from PyQt6.QtCore       import QThread, pyqtSignal
+
+from threading          import Condition
+
+
+class ArbWorker(QThread):
+    '''
+    Background waveform design, download and play of the ARB.
+    The GUI submits the waveform settings, the worker keeps only the latest request in a single-slot mailbox,
+    thus rapid changes (e.g. turning a dial) collapse into the last one and the GUI thread never waits
+    for the instrument. A request superseded by a newer one is abandoned at the next step:
+    after the design (no download) or after the download (not played, kept in the waveform cache).
+    A download that already started is not interrupted (a blocking transfer).
+    '''
+    log         = pyqtSignal(str)
+    playing     = pyqtSignal(str) # Waveform ID played
+
+    def __init__(self, wfm_cache, design, prefix:str='wfm'):
+        super().__init__()
+        self.wfm_cache      = wfm_cache     # WaveformCache of the ARB (download and play)
+        self.design         = design        # Callable(**request) returning the waveform
+        self.prefix         = prefix        # Waveform name prefix
+        self.mailbox        = None          # Latest request (None - no new request)
+        self.cond           = Condition()
+        self.n_superseded   = 0             # Requests replaced before they were played
+        self.running        = False
+
+    def submit(self, **request):
+        # Replace the pending request with the latest one
+        with self.cond:
+            if self.mailbox is not None:
+                self.n_superseded += 1
+            self.mailbox = request
+            self.cond.notify()
+
+    def superseded(self) -> bool:
+        # A newer request is waiting
+        with self.cond:
+            if self.mailbox is not None:
+                self.n_superseded += 1
+                return True
+            return False
+
+    def run(self):
+        self.running = True
+        while True:
+            with self.cond:
+                while self.running and self.mailbox is None:
+                    self.cond.wait()
+                if not self.running:
+                    return
+                request, self.mailbox = self.mailbox, None
+            try:
+                wfm = self.design(**request)
+                if self.superseded():
+                    continue
+                self.wfm_cache.load(wfm, self.prefix)
+                if self.superseded():
+                    continue
+                self.playing.emit(self.wfm_cache.play(wfm, self.prefix))
+            except Exception as e:
+                self.log.emit(f"Thread: ARB update failed: {e}")
+
+    def stop(self):
+        with self.cond:
+            self.running = False
+            self.cond.notify()
@@ -0,0 +1,131 @@
+# Waveform library of the ARB
+# A YAML manifest (wfm_library.yaml) lists the test waveforms of the station (multitone, notched multitone,
+# modulated). build_library() designs the waveforms that are not in the on-disk cache yet, in parallel
+# (process pool), and saves them compressed (<cache>/<name>_<hash>.npz, the hash of the waveform spec),
+# thus a changed spec is designed again and an unchanged one is read from the disk.
+# load_library() downloads to the VSG, in one session, only the waveforms that are not in its memory
+# (WaveformCache, waveforms named by a content hash).
+
+import os
+import json
+import hashlib
+
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+import yaml
+
+from o218_mutitone import mutitone
+
+
+def spec_hash(spec: dict, Fs: float) -> str:
+    # Hash of everything that defines the waveform (the name is only a label)
+    spec = {k: v for k, v in spec.items() if k != 'name'}
+    return hashlib.blake2b(json.dumps([spec, Fs], sort_keys=True).encode(), digest_size=8).hexdigest()
+
+def notched_multitone(BW: float, Ntones: int, Fs: float, Nfft: int, notch_bw: float, notch_fc: float = 0.0,
+                      phase: str = 'newman') -> np.ndarray:
+    '''
+    Multi-tone with the tones in [notch_fc - notch_bw/2, notch_fc + notch_bw/2] removed (NPR test signal)
+    '''
+    _, X, F = mutitone(BW, Ntones, Fs, Nfft, phase)
+    X       = X.copy()
+    X[np.abs(F - notch_fc) <= notch_bw / 2] = 0
+    x       = np.fft.ifft(np.fft.ifftshift(X))
+    return x / np.max(np.abs(x))
+
+def modulated(Fs: float, symbol_rate: float, Nsymbols: int = 1024, order: int = 4, alpha: float = 0.35,
+              seed: int = 0) -> np.ndarray:
+    '''
+    Random QAM symbols with root raised cosine pulse shaping, periodic (seamless loop in the ARB)
+    The shaping is done in the frequency domain of the whole period (circular, no filter transients).
+    :param Fs: Sampling frequency (MHz)
+    :param symbol_rate: MSym/sec, Fs/symbol_rate must be an integer (samples per symbol)
+    :param order: QAM order (4 - QPSK, 16, 64, ...)
+    :param alpha: RRC roll off
+    :param seed: Random symbols seed (the same spec is the same waveform)
+    '''
+    sps     = int(round(Fs / symbol_rate))
+    m       = int(round(np.sqrt(order)))
+    rng     = np.random.default_rng(seed)
+    levels  = 2 * np.arange(m) - (m - 1)
+    symbols = rng.choice(levels, Nsymbols) + 1j * rng.choice(levels, Nsymbols)
+    # Upsample by zero insertion (the spectrum repeats every symbol rate), then the RRC response
+    N       = Nsymbols * sps
+    up      = np.zeros(N, dtype=complex)
+    up[::sps] = symbols
+    X       = np.fft.fftshift(np.fft.fft(up))
+    f       = np.abs(np.fft.fftshift(np.fft.fftfreq(N, d=1 / sps)))   # In symbol rate units
+    H       = np.where(f <= (1 - alpha) / 2, 1.0, 0.0)
+    roll    = (f > (1 - alpha) / 2) & (f <= (1 + alpha) / 2)
+    H[roll] = np.sqrt(0.5 * (1 + np.cos(np.pi / alpha * (f[roll] - (1 - alpha) / 2))))
+    x       = np.fft.ifft(np.fft.ifftshift(X * H))
+    return x / np.max(np.abs(x))
+
+def design_waveform(spec: dict, Fs: float) -> np.ndarray:
+    '''
+    Design a waveform of the manifest (runs in a worker process)
+    :param spec: Manifest entry - name, type and the parameters of the type
+    :param Fs: ARB sampling frequency (MHz)
+    '''
+    kind   = spec['type']
+    params = {k: v for k, v in spec.items() if k not in ('name', 'type')}
+    if kind == 'multitone':
+        return mutitone(Fs=Fs, **params)[0]
+    if kind == 'notched_multitone':
+        return notched_multitone(Fs=Fs, **params)
+    if kind == 'modulated':
+        return modulated(Fs=Fs, **params)
+    raise ValueError(f"{spec['name']}: unknown waveform type {kind}")
+
+def read_manifest(file_name: str = "wfm_library.yaml") -> dict:
+    with open(file_name, "r") as f:
+        manifest = yaml.safe_load(f)
+    names = [spec['name'] for spec in manifest['Waveforms']]
+    if len(set(names)) != len(names):
+        raise ValueError(f"{file_name}: duplicate waveform names")
+    return manifest
+
+def build_library(manifest: dict, max_workers: int = None) -> dict:
+    '''
+    Design the waveforms that are not in the on-disk cache (in parallel) and save them
+    :return: name -> waveform of every waveform in the manifest
+    '''
+    Fs        = manifest['Fs']
+    cache_dir = manifest.get('CacheDir', 'wfm_cache')
+    os.makedirs(cache_dir, exist_ok=True)
+    files     = {spec['name']: os.path.join(cache_dir, f"{spec['name']}_{spec_hash(spec, Fs)}.npz")
+                 for spec in manifest['Waveforms']}
+
+    library   = {}
+    missing   = []
+    for spec in manifest['Waveforms']:
+        if os.path.exists(files[spec['name']]):
+            library[spec['name']] = np.load(files[spec['name']])['iq']
+        else:
+            missing.append(spec)
+    print(f"Waveform library: {len(library)} cached, {len(missing)} to design")
+
+    if missing:
+        with ProcessPoolExecutor(max_workers=max_workers) as pool:
+            for spec, wfm in zip(missing, pool.map(design_waveform, missing, [Fs] * len(missing))):
+                # Saved under a temporary name and renamed, thus a cache file is never partial
+                tmp_file = files[spec['name']] + ".tmp"
+                with open(tmp_file, "wb") as f:
+                    np.savez_compressed(f, iq=wfm)
+                os.replace(tmp_file, files[spec['name']])
+                library[spec['name']] = wfm
+    # In the order of the manifest
+    return {spec['name']: library[spec['name']] for spec in manifest['Waveforms']}
+
+def load_library(wfm_cache, library: dict) -> dict:
+    '''
+    Download the waveforms of the library that are not in the VSG memory (one session, one catalog read)
+    :param wfm_cache: WaveformCache of the VSG
+    :return: name -> waveform ID in the VSG memory
+    '''
+    n_downloads = wfm_cache.n_downloads
+    ids         = {name: wfm_cache.load(wfm, prefix=name) for name, wfm in library.items()}
+    print(f"Waveform library: {wfm_cache.n_downloads - n_downloads} downloaded, "
+          f"{len(ids) - (wfm_cache.n_downloads - n_downloads)} already in the VSG")
+    return ids
@@ -10,13 +10,18 @@ from    PyQt6.uic          import loadUi
 from    PyQt6.QtCore       import QTimer
 
 from    time               import sleep
+from    contextlib         import contextmanager
+from    threading          import RLock
 
 import numpy as np
 import logging # for pyinstaller
 
 from python_rf_course_utils.qt import h_gui, PlotWidget, setup_logger
 
-from o310_long_process import LongProcess
+from o310_long_process import LongProcess, SegmentBuffer
+from o311_vsa_trace     import set_trace_format, TraceReader
+from o312_envelope_plot import EnvelopePlotWidget
+from o313_trace_worker  import TraceWorker
 
 
 def is_valid_ip(ip:str) -> bool:
@@ -68,6 +73,23 @@ class LabDemoVsaControl(QMainWindow):
         # Create a Resource Manager object
         self.rm         = pyvisa.ResourceManager('@py')
         self.vsa        = None
+        # Trace transfer format (True - binary REAL,32, False - ASCII)
+        self.binary_trace = True
+        # Trace reads with the cached frequency axis (created on connect)
+        self.trace_reader = None
+        # Cached sweep time (sec), None - re-query the analyzer
+        self.sweep_time   = None
+        # Error checking mode (True - SYST:ERR? after every write, False - once per batch)
+        self.strict_errors = False
+        # Commands written in the current batch (None - not in a batch)
+        self.vsa_cmds     = None
+        # The VISA session is shared by the GUI and the trace worker threads
+        self.vsa_lock     = RLock()
+        self.worker       = None
+        # Stopped trace workers that did not finish yet -> action when they finish (referenced until then)
+        self.stopping     = {}
+        # Streamed hi-res scan (None - no scan streaming)
+        self.hires_buffer = None
 
         # Load the configuration/default values from the YAML file
         self.Params     = None
@@ -83,7 +105,8 @@ class LabDemoVsaControl(QMainWindow):
         self.h_gui['Save'].emit() #  self.cb_save
 
         # Create a widget for the Spectrum Analyzer plot
-        self.plot_sa        = PlotWidget()
+        # The envelope plot draws a per-pixel min/max envelope (fast redraw of the hi-res snapshot)
+        self.plot_sa        = EnvelopePlotWidget() if self.Params.get('EnvelopePlot', True) else PlotWidget()
         layout              = QVBoxLayout(self.widget)
         layout.addWidget(self.plot_sa)
         # Set the background color of the plot widget to white
@@ -95,40 +118,140 @@ class LabDemoVsaControl(QMainWindow):
         self.timer.start(self.h_gui['Refresh'].get_val())
 
     def cb_refresh(self):
+        if self.worker is not None:
+            self.worker.interval_ms = self.h_gui['Refresh'].get_val()
+            if self.worker.sweep_time is not None:
+                # Adaptive mode - the worker schedules the reads, the timer only polls its mailbox
+                return
         self.timer.setInterval(self.h_gui['Refresh'].get_val())
 
-    def vsa_write(self, cmd:str):
+    def start_trace_worker(self):
+        # Read the traces in the background, the timer only renders the latest frame
+        if self.vsa is not None and self.worker is None and self.Params.get('AsyncTrace', True):
+            # Adaptive mode - reads are scheduled from the sweep time, the refresh interval is the upper bound
+            sweep_time  = self.vsa_sweep_time if self.Params.get('AdaptiveRefresh', True) else None
+            self.worker = TraceWorker(self.vsa_read_trace, self.h_gui['Refresh'].get_val(), sweep_time)
+            self.worker.log.connect(self.log.error)
+            self.worker.start()
+            if sweep_time is not None:
+                self.timer.setInterval(self.worker.min_interval_ms)
+
+    def stop_trace_worker(self, then=None):
+        '''
+        Stop the trace worker without blocking the GUI (a trace read in progress ends up to the VISA timeout)
+        :param then: Called in the GUI thread once the worker finished (at once if there is no worker),
+            e.g. the next owner of the instrument
+        '''
+        worker, self.worker = self.worker, None
+        if worker is None:
+            if then is not None:
+                then()
+            return
+        self.timer.setInterval(self.h_gui['Refresh'].get_val())
+        worker.stop()
+        self.stopping[worker] = then
+        worker.finished.connect(self.cb_worker_finished)
+        if worker.isFinished():
+            # Finished before the signal was connected
+            self.worker_finished(worker)
+
+    def cb_worker_finished(self):
+        self.worker_finished(self.sender())
+
+    def worker_finished(self, worker):
+        # Once per worker (the finished signal and the isFinished check may both report it)
+        if worker in self.stopping:
+            then = self.stopping.pop(worker)
+            if then is not None:
+                then()
+
+    def vsa_invalidate(self):
+        # The frequency/RBW settings changed, re-query the frequency axis and the sweep time
+        if self.trace_reader is not None:
+            self.trace_reader.invalidate()
+        self.sweep_time = None
+
+    def vsa_write(self, cmd:str, invalidate:bool=False):
+        '''
+        :param invalidate: The command changes the frequency/RBW settings, invalidate the cached frequency axis
+            and sweep time under the same lock (the trace worker never pairs a new trace with the old axis)
+        '''
         if self.vsa is not None:
-            # Add logging to the write command (Debug Level)
-            self.log.debug(f"VSA Write: {cmd}")
-            self.vsa.write(cmd)
-            # Check for errors
-            e = self.vsa.query('SYST:ERR?').strip().split(',')
-            if int(e[0]) != 0:
-                self.log.error(f"Error: {e[1]}")
+            with self.vsa_lock:
+                # Add logging to the write command (Debug Level)
+                self.log.debug(f"VSA Write: {cmd}")
+                self.vsa.write(cmd)
+                # Reset/Recall change the frequency settings, invalidate the frequency axis
+                if invalidate or cmd.upper().startswith(("*RST", "*RCL")):
+                    self.vsa_invalidate()
+                if self.vsa_cmds is not None:
+                    # Deferred mode - the errors are checked at the end of the batch
+                    self.vsa_cmds.append(cmd)
+                else:
+                    # Check for errors
+                    self.vsa_check_errors([cmd])
+
+    def vsa_check_errors(self, cmds:list, max_errors:int=32):
+        # Drain the error queue, a single query if there are no errors
+        for _ in range(max_errors):
+            e = self.vsa.query('SYST:ERR?').strip().split(',', 1)
+            if int(e[0]) == 0:
+                break
+            self.log.error(f"Error: {e[1]} (Command: {self.vsa_error_source(e[1], cmds)})")
+
+    @staticmethod
+    def vsa_error_source(msg:str, cmds:list) -> str:
+        # The error message usually ends with the offending command, e.g. "Undefined header;FREQ:CENTT 1 MHz"
+        detail = msg.strip().strip('"').partition(';')[2].strip().upper()
+        if detail:
+            for cmd in cmds:
+                if cmd.upper().startswith(detail) or detail.startswith(cmd.upper().split()[0]):
+                    return cmd
+        if len(cmds) == 1:
+            return cmds[0]
+        # Can not attribute the error to a single command, report the whole batch
+        return ' ; '.join(cmds)
+
+    @contextmanager
+    def vsa_batch(self):
+        '''
+        Defer the error checking of the VSA writes to the end of the batch
+        with self.vsa_batch():
+            self.vsa_write(...)
+            self.vsa_write(...)
+        '''
+        # The trace worker is held off for the whole batch
+        with self.vsa_lock:
+            if self.strict_errors or self.vsa_cmds is not None:
+                # Strict mode or nested batch - nothing to defer
+                yield
+                return
+            self.vsa_cmds = []
+            try:
+                yield
+                cmds = self.vsa_cmds
+            finally:
+                self.vsa_cmds = None
+            if self.vsa is not None and cmds:
+                self.vsa_check_errors(cmds)
 
     def vsa_query(self, cmd:str):
         if self.vsa is not None:
-            # Add logging to the query command (Debug Level)
-            self.log.debug(f"VSA Query: {cmd}")
-            return self.vsa.query(cmd).strip()
+            with self.vsa_lock:
+                # Add logging to the query command (Debug Level)
+                self.log.debug(f"VSA Query: {cmd}")
+                return self.vsa.query(cmd).strip()
 
     def vsa_read_trace(self):
-        if self.vsa is not None:
-            # Query the instrument for the trace data
-            trace_id = 1
-            # Query trace data PyVISA method for reading numerical data from instruments
-            p           = self.vsa.query_ascii_values(":TRACe:DATA? TRACE1", container=np.array)
-            # Build the frequency list
-
-            # Get the current frequency settings
-            start_freq  = float(self.vsa_query(":FREQuency:START?" ))*1e-6
-            stop_freq   = float(self.vsa_query(":FREQuency:STOP?"  ))*1e-6
-            num_points  =   int(self.vsa_query(":SENSe:SWEep:POIN?"))
-            # Calculate frequency points
-            f           = np.linspace(start_freq, stop_freq, num_points)
+        # Trace data (binary REAL,32 block or ASCII values) and its cached frequency axis
+        if self.trace_reader is not None:
+            return self.trace_reader.read()
 
-            return p, f
+    def vsa_sweep_time(self):
+        # Sweep time (sec) reported by the analyzer, cached like the frequency axis
+        if self.sweep_time is None:
+            self.sweep_time = float(self.vsa_query(":SENSe:SWEep:TIME?"))
+        return self.sweep_time
 
 
     # Callback function for the Connect button
@@ -139,7 +262,12 @@ class LabDemoVsaControl(QMainWindow):
             # Open the connection to the signal generator
             try:
                 ip              = self.h_gui['IP'].get_val()
-                self.vsa        = self.rm.open_resource(f"TCPIP0::{ip}::inst0::INSTR")
+                resource        = self.Params.get('Resource', "TCPIP0::{ip}::inst0::INSTR").format(ip=ip)
+                self.vsa        = self.rm.open_resource(resource)
+                if resource.endswith('SOCKET'):
+                    # Raw socket (e.g. the simulator) - messages are terminated by a new line
+                    self.vsa.read_termination  = '\n'
+                    self.vsa.write_termination = '\n'
                 self.vsa.timeout = 60000
                 self.log.info(f"Connected to {ip}")
                 # Read the signal generator status and update the GUI (RF On/Off, Modulation On/Off,Pout and Fc)
@@ -150,32 +278,44 @@ class LabDemoVsaControl(QMainWindow):
                 idn         = idn.split(',')[0:3]
                 idn         = ', '.join(idn)
                 self.setWindowTitle(idn)
-                # Reset and clear all status (errors) of the spectrum analyzer
-                self.vsa_write("*RST")
-                self.vsa_write("*CLS")
-                sleep(.1)
-                # Aligned the spectrum analyzer to the GUI values
-                self.cb_fc()
-                self.cb_rbw()
-                self.cb_span()
-                self.cb_trace()
-                self.cb_detector()
-                # Sweep mode to continuous
-                self.vsa_write(":INITiate:CONTinuous ON")
+                # Write the setup as a single batch (errors are checked once at the end)
+                with self.vsa_batch():
+                    # Reset and clear all status (errors) of the spectrum analyzer
+                    self.vsa_write("*RST")
+                    self.vsa_write("*CLS")
+                    sleep(.1)
+                    # Set the trace transfer format (*RST sets it to ASCII)
+                    binary_trace = self.Params.get('BinaryTrace', True)
+                    self.binary_trace = set_trace_format(self.vsa, binary_trace)
+                    if binary_trace and not self.binary_trace:
+                        self.log.warning("Binary trace format not supported, using ASCII")
+                    self.trace_reader = TraceReader(self.vsa, self.binary_trace, lock=self.vsa_lock,
+                                                    query=self.vsa_query)
+                    # Aligned the spectrum analyzer to the GUI values
+                    self.cb_fc()
+                    self.cb_rbw()
+                    self.cb_span()
+                    self.cb_trace()
+                    self.cb_detector()
+                    # Sweep mode to continuous
+                    self.vsa_write(":INITiate:CONTinuous ON")
+                self.start_trace_worker()
 
             except Exception:
                 self.log.error("Connection failed")
-                if self.vsa is not None:
-                    self.vsa.close()
-                    self.vsa = None
+                self.vsa_close()
                 # Clear Button state
                 self.h_gui['Connect'].set_val(False, is_callback=True)
         else:
             self.log.info("Connect button Cleared")
             # Close the connection to the signal generator
-            if self.vsa is not None:
-                self.vsa.close()
-                self.vsa = None
+            self.vsa_close()
+
+    def vsa_close(self):
+        # The session is closed once the trace worker finished its read (the GUI is not blocked)
+        vsa, self.vsa     = self.vsa, None
+        self.trace_reader = None
+        self.stop_trace_worker(then=vsa.close if vsa is not None else None)
 
 
     # Callback function for the IP lineEdit
@@ -201,7 +341,7 @@ class LabDemoVsaControl(QMainWindow):
             # Set the default value to the GUI object
             self.h_gui['Fc'].set_val(frequency_mhz)
 
-        self.vsa_write(f"sense:FREQuency:CENTer {frequency_mhz} MHz") # can replace the '} MHz' with '}e6'
+        self.vsa_write(f"sense:FREQuency:CENTer {frequency_mhz} MHz", invalidate=True) # can replace the '} MHz' with '}e6'
         self.log.info(f"Fc = {frequency_mhz} MHz")
 
     def cb_rbw(self):
@@ -214,7 +354,7 @@ class LabDemoVsaControl(QMainWindow):
             # Set the default value to the GUI object
             self.h_gui['RBW'].set_val(rbw)
 
-        self.vsa_write(f"sense:BANDwidth:RESolution {rbw} MHz")
+        self.vsa_write(f"sense:BANDwidth:RESolution {rbw} MHz", invalidate=True)
         self.log.info(f"RBW = {rbw} MHz")
 
     def cb_span(self):
@@ -227,7 +367,7 @@ class LabDemoVsaControl(QMainWindow):
             # Set the default value to the GUI object
             self.h_gui['Span'].set_val(span)
 
-        self.vsa_write(f"sense:FREQuency:SPAN {span} MHz")
+        self.vsa_write(f"sense:FREQuency:SPAN {span} MHz", invalidate=True)
         self.log.info(f"Span = {span} MHz")
 
     def cb_trace(self):
@@ -275,8 +415,9 @@ class LabDemoVsaControl(QMainWindow):
             ref_level   = np.ceil(( y_max + 5.0 ) / 5.0) * 5.0
             scale2div   = np.round((ref_level - y_min)/10.0) + 1
 
-            self.vsa_write( f"DISP:WIND:TRAC:Y:PDIV {scale2div}")
-            self.vsa_write( f"DISP:WIND:TRAC:Y:RLEV {ref_level}")
+            with self.vsa_batch():
+                self.vsa_write( f"DISP:WIND:TRAC:Y:PDIV {scale2div}")
+                self.vsa_write( f"DISP:WIND:TRAC:Y:RLEV {ref_level}")
 
     def cb_hires_scan(self,i):
         self.h_gui['HiResProgress'].set_val(i)
@@ -285,27 +426,59 @@ class LabDemoVsaControl(QMainWindow):
         if self.vsa is not None:
             if self.sender().isChecked():
                 self.log.info("HiResSnapshot button Checked")
-                self.thread = LongProcess(self.vsa)
+                self.thread = LongProcess(self.vsa, binary=self.binary_trace,
+                                          pipelined=self.Params.get('PipelinedScan', True),
+                                          stream=self.Params.get('StreamScan', True),
+                                          sink_file=self.Params.get('HiResSink', None))
                 self.thread.progress.connect(self.cb_hires_scan)
                 self.thread.data.connect(self.cb_hi_res_plot)
+                self.thread.segment.connect(self.cb_hi_res_segment)
+                self.thread.log.connect(self.log.info)
 
                 self.timer.stop()
-                self.thread.start() # Start the thread calling the run method
+                # The scan owns the instrument until it is stopped, started once the trace worker finished
+                self.stop_trace_worker(then=self.hires_start)
             else:
                 self.log.info("HiResSnapshot button Cleared")
                 self.thread.stop()
                 self.thread.wait()
                 self.h_gui['HiResProgress'].set_val(0)
+                if self.hires_buffer is not None:
+                    # The segments received since the last (throttled) redraw
+                    self.cb_hi_res_draw()
+                    self.hires_buffer = None
+                # The scan recalls the instrument state, invalidate the frequency axis
+                self.vsa_invalidate()
+                self.start_trace_worker()
                 self.timer.start()
 
 
     def timer_refresh_plot(self):
         if self.vsa is not None:
-            y,x = self.vsa_read_trace()
-            self.plot_sa.plot( x , y ,
-                               line='b-' , line_width=4.0,
-                               xlabel='Frequency (MHz)', ylabel='Power dBm',
-                               title='PSA', xlog=False, clf=True)
+            if self.worker is not None:
+                # Render the latest frame of the trace worker (if there is a new one)
+                frame = self.worker.take()
+                if frame is None:
+                    return
+                y,x = frame
+            else:
+                y,x = self.vsa_read_trace()
+            if isinstance(self.plot_sa, EnvelopePlotWidget):
+                # Persistent curve, only the data of the curve is replaced after the first frame
+                self.plot_sa.update_curve('PSA', x , y ,
+                                   line='b-' , line_width=4.0,
+                                   xlabel='Frequency (MHz)', ylabel='Power dBm',
+                                   title='PSA', xlog=False, clf=True)
+            else:
+                self.plot_sa.plot( x , y ,
+                                   line='b-' , line_width=4.0,
+                                   xlabel='Frequency (MHz)', ylabel='Power dBm',
+                                   title='PSA', xlog=False, clf=True)
+
+    def hires_start(self):
+        # Unless the snapshot was cleared while the trace worker was finishing
+        if self.h_gui['HiResSnapshot'].obj.isChecked():
+            self.thread.start() # Start the thread calling the run method
 
     def cb_hi_res_plot(self, freq, power):
             self.plot_sa.plot( freq , power ,
@@ -313,6 +486,22 @@ class LabDemoVsaControl(QMainWindow):
                                xlabel='Frequency (MHz)', ylabel='Power dBm',
                                title='Hi-Res PSA', xlog=False, clf=True)
 
+    def cb_hi_res_segment(self, offset, freq, power):
+            # Streaming mode - the segments fill a preallocated scan buffer, redrawn at the refresh rate
+            if offset == 0:
+                self.hires_buffer = SegmentBuffer(self.thread.scan_freq(), self.h_gui['Refresh'].get_val()*1e-3)
+            if self.hires_buffer.fill(offset, power):
+                self.cb_hi_res_draw()
+
+    def cb_hi_res_draw(self):
+            kwargs = dict(line='b-' , line_width=4.0, xlabel='Frequency (MHz)', ylabel='Power dBm',
+                          title='Hi-Res PSA', xlog=False, clf=True)
+            if isinstance(self.plot_sa, EnvelopePlotWidget):
+                # Persistent curve, only its data is replaced after the first redraw
+                self.plot_sa.update_curve('HiRes', self.hires_buffer.freq, self.hires_buffer.power, **kwargs)
+            else:
+                self.plot_sa.plot(self.hires_buffer.freq, self.hires_buffer.power, **kwargs)
+
     def cb_save(self):
         self.log.info("Save")
         # Read the values from the GUI objects and save them to the Params dictionary
@@ -339,10 +528,15 @@ class LabDemoVsaControl(QMainWindow):
                 self.h_gui[key].set_val(value, is_callback=True)
 
         # Additional configuration parameters
-
+        self.strict_errors = self.Params.get('StrictErrors', False)
 
     def closeEvent(self, event):
         self.log.info("Exiting the application")
+        self.timer.stop()
+        self.stop_trace_worker()
+        # Exiting - wait for the stopped workers (their wait between reads is interrupted)
+        for worker in list(self.stopping):
+            worker.wait()
         # Clean up the resources
         # Close the connection to the signal generator
         if self.vsa is not None:
@@ -1,21 +1,113 @@
 from PyQt6.QtCore       import QThread, pyqtSignal
 
+from contextlib         import contextmanager
+from time               import perf_counter
+
 import numpy as np
 
+from o311_vsa_trace     import set_trace_format, read_trace, fetch_trace, parse_trace
+
+
+class StageTiming:
+    '''
+    Accumulate the durations of the scan stages (e.g. configure, sweep, transfer, parse)
+    with timing.measure('transfer'):
+        ...
+    '''
+    def __init__(self):
+        self.durations = {}
+
+    def add(self, stage:str, seconds:float):
+        self.durations.setdefault(stage, []).append(seconds)
+
+    @contextmanager
+    def measure(self, stage:str):
+        t_start = perf_counter()
+        try:
+            yield
+        finally:
+            self.add(stage, perf_counter() - t_start)
+
+    def report(self) -> str:
+        lines = []
+        for stage, d in self.durations.items():
+            lines.append(f"{stage:<10}: {len(d):4d} x {np.mean(d)*1e3:8.2f} ms = {np.sum(d):7.3f} s")
+        return '\n'.join(lines)
+
+
+class SegmentSink:
+    '''
+    Write the hi-res scan segments to a .npy file as they arrive
+    The file holds a (segments x 2 x points) array, [:, 0] - frequency (MHz), [:, 1] - power (dBm)
+    '''
+    def __init__(self, file_name:str, n_segments:int, n_points:int):
+        self.file_name = file_name
+        self.mm = np.lib.format.open_memmap(file_name, mode='w+', dtype=float, shape=(n_segments, 2, n_points))
+
+    def write(self, i:int, freq:np.ndarray, power:np.ndarray):
+        self.mm[i, 0] = freq
+        self.mm[i, 1] = power
+        # Flush the segment to the disk
+        self.mm.flush()
+
+    def close(self):
+        self.mm.flush()
+        del self.mm
+
+
+class SegmentBuffer:
+    '''
+    GUI side buffer of a streamed hi-res scan - preallocated (segments x points, flattened, NaN - not received),
+    every segment fills its slot and the plot is redrawn at a throttled rate (one persistent curve)
+    buffer = SegmentBuffer(thread.scan_freq(), interval=0.25)
+    if buffer.fill(offset, power):
+        plot.update_curve('HiRes', buffer.freq, buffer.power, ...)
+    '''
+    def __init__(self, freq:np.ndarray, interval:float=0.25):
+        self.freq       = freq
+        self.power      = np.full(len(freq), np.nan)
+        self.interval   = interval  # Minimal time between redraws (sec)
+        self.n_filled   = 0
+        self.t_draw     = None      # Time of the last redraw (None - not drawn yet)
+
+    def fill(self, offset:int, power:np.ndarray) -> bool:
+        '''
+        Store a segment in its slot
+        :return: True if the plot is due for a redraw (first segment, interval elapsed or the scan is complete)
+        '''
+        self.power[offset:offset + len(power)] = power
+        self.n_filled  += len(power)
+        t_now           = perf_counter()
+        if self.t_draw is None or t_now - self.t_draw >= self.interval or self.n_filled >= len(self.power):
+            self.t_draw = t_now
+            return True
+        return False
+
 
 class LongProcess(QThread):
     # Define signals as class attributes (for progressbar and returned data)
     progress    = pyqtSignal(int)
     data        = pyqtSignal(np.ndarray, np.ndarray)
+    segment     = pyqtSignal(int, np.ndarray, np.ndarray) # offset, freq, power (streaming mode)
+    log         = pyqtSignal(str)
 
-    def __init__(self, vsa):
+    def __init__(self, vsa, binary=True, pipelined=False, stream=False, sink_file=None):
         super().__init__()
         self.vsa = vsa
+        self.binary = binary # Trace transfer format (True - REAL,32, False - ASCII)
+        self.pipelined = pipelined # Parse and store the previous segment while the next one is swept (the transfer is not overlapped)
+        self.stream = stream # Emit every segment as it is read instead of the whole scan at the end
+        self.sink_file = sink_file # Optional .npy file the segments are written to as they arrive
         self.running = False
+        self.timing = StageTiming()
+        self.sink = None
+        self.all_data = None
 
     def run(self):
         # Save the instrument attributes for recall at the end of the scan
         self.running = True
+        # Set the trace transfer format before saving the state
+        self.binary = set_trace_format(self.vsa, self.binary)
         self.vsa.write("*SAV 1")
         # Hi-Res scan of the spectrum analyzer
         fc              = float(self.vsa.query(':sens:FREQ:CENT?').strip())*1e-6  # MHz Center Frequency
@@ -40,7 +132,7 @@ class LongProcess(QThread):
         self.vsa.query("*OPC?")
         # Read the trace data
         # Query the instrument for the trace data
-        trace_data  = self.vsa.query_ascii_values(':TRAC? TRACE1', container=np.array)
+        trace_data  = read_trace(self.vsa, self.binary)
         max_level   = np.ceil( np.max(trace_data)/5 + 1)*5
         # Set the reference level
         self.vsa.write(f"DISP:WIND:TRAC:Y:RLEV {max_level}")
@@ -53,45 +145,111 @@ class LongProcess(QThread):
         # Set single sweep mode
         self.vsa.write("INITiate:CONTinuous OFF"                        )
 
-        # Create a list to store the scan data
-        all_data = []
-        all_freq = []
+        # Number of points per segment (constant for the whole scan)
+        num_points      = int(self.vsa.query(':SENS:SWE:POIN?'))
+        # Frequency axis of a segment relative to its center frequency
+        self.Fscan      = Fscan
+        self.seg_axis   = np.linspace(-span/2, span/2, num_points)
+        # Preallocate the scan data (segments x points), the streaming mode holds no scan data
+        self.all_data   = None if self.stream else np.empty((len(Fscan), num_points),
+                                                              dtype=np.float32 if self.binary else float)
+        if self.sink_file is not None:
+            self.sink   = SegmentSink(self.sink_file, len(Fscan), num_points)
+        # Clear the standard event status register (pipelined mode polls its OPC bit)
+        self.vsa.query("*ESR?")
+        self.timing = StageTiming()
+        raw_data = None # Raw trace of the previous segment (pipelined mode)
         for i, f in enumerate(Fscan):
             # Set the center frequency
-            self.vsa.write(f"sense:FREQuency:CENTer {f} MHz")
-            # Initiate a single sweep
-            self.vsa.write("INITiate:IMMediate")
-            # Wait for the sweep to complete
-            # time_start = time.perf_counter()
-            self.vsa.query("*OPC?")
-            # print(f"Sweep {i+1} completed in {time.perf_counter() - time_start:.2f} seconds")
-            # Query the instrument for the trace data
-            trace_data = self.vsa.query_ascii_values(':TRAC? TRACE1', container=np.array)
-
-            # Get the current frequency settings
-            start_freq  = float(self.vsa.query(':SENS:FREQ:START?'))
-            stop_freq   = float(self.vsa.query(':SENS:FREQ:STOP?' ))
-            num_points  =   int(self.vsa.query(':SENS:SWE:POIN?'  ))
-
-            # Calculate frequency points
-            f           = np.linspace(start_freq*1e-6, stop_freq*1e-6, num_points)
-
-            # Append the data to the list (in a flattened format)
-            all_data = np.concatenate([all_data, trace_data  ])
-            all_freq = np.concatenate([all_freq, f           ])
+            with self.timing.measure('configure'):
+                self.vsa.write(f"sense:FREQuency:CENTer {f} MHz")
+            if self.pipelined:
+                # Initiate a single sweep, *OPC sets the OPC bit of the ESR when it completes
+                self.vsa.write("INITiate:IMMediate;*OPC")
+                # Parse and store the previous segment while the instrument sweeps
+                if raw_data is not None:
+                    with self.timing.measure('parse'):
+                        trace_data = parse_trace(raw_data, self.binary)
+                    with self.timing.measure('store'):
+                        self.store_segment(i - 1, trace_data)
+                # Wait for the sweep to complete (polling, can be stopped), the rest of the sweep after the host work
+                t_sweep = perf_counter()
+                if not self.wait_sweep():
+                    raw_data = None
+                    break
+                self.timing.add('sweep', perf_counter() - t_sweep)
+                # Transfer the trace data, parsed during the next sweep
+                with self.timing.measure('transfer'):
+                    raw_data = fetch_trace(self.vsa, self.binary)
+            else:
+                t_sweep = perf_counter()
+                # Initiate a single sweep
+                self.vsa.write("INITiate:IMMediate")
+                # Wait for the sweep to complete
+                self.vsa.query("*OPC?")
+                self.timing.add('sweep', perf_counter() - t_sweep)
+                # Query the instrument for the trace data and store it in the segment slot
+                with self.timing.measure('transfer'):
+                    raw_data = fetch_trace(self.vsa, self.binary)
+                with self.timing.measure('parse'):
+                    trace_data = parse_trace(raw_data, self.binary)
+                with self.timing.measure('store'):
+                    self.store_segment(i, trace_data)
+                raw_data = None
             # Update the progress bar
             self.progress.emit(100 * (i + 1) // len(Fscan))
             if not self.running:
                 break
 
+        # Parse the last segment (pipelined mode)
+        if raw_data is not None:
+            with self.timing.measure('parse'):
+                trace_data = parse_trace(raw_data, self.binary)
+            with self.timing.measure('store'):
+                self.store_segment(i, trace_data)
+        self.log.emit("Thread: Hi-Res scan timing\n" + self.timing.report())
+        if self.sink is not None:
+            self.sink.close()
+            self.sink = None
+            self.log.emit(f"Thread: Hi-Res scan saved to {self.sink_file}")
+
         # Recall the instrument settings
         self.vsa.write("*RCL 1")
         # Set continuous sweep mode
         self.vsa.write("INITiate:CONTinuous ON")
-        if self.running:
-            # Emit the data signal
-            self.data.emit(all_freq , all_data)
+        if self.running and not self.stream:
+            # Frequency axis of each segment calculated from its center frequency and span
+            # Emit the data signal (in a flattened format)
+            self.data.emit(self.scan_freq() , self.all_data.ravel())
+        self.all_data = None
+
+    def scan_freq(self) -> np.ndarray:
+        # Frequency axis of the whole scan (flattened segments), known once the scan is configured
+        return (self.Fscan[:, np.newaxis] + self.seg_axis).ravel()
+
+    def store_segment(self, i:int, trace_data:np.ndarray):
+        freq = self.Fscan[i] + self.seg_axis
+        if self.all_data is not None:
+            self.all_data[i] = trace_data
+        if self.stream:
+            # Emit the segment with its offset in the (flattened) scan
+            self.segment.emit(i*len(self.seg_axis), freq, trace_data)
+        if self.sink is not None:
+            self.sink.write(i, freq, trace_data)
+
 
+    def wait_sweep(self, poll_ms:int=5) -> bool:
+        # Poll the operation complete bit (bit 0) of the standard event status register
+        t_timeout = perf_counter() + self.vsa.timeout*1e-3
+        while self.running:
+            if int(self.vsa.query("*ESR?")) & 1:
+                return True
+            if perf_counter() > t_timeout:
+                self.log.emit("Thread: Sweep timeout")
+                self.running = False
+                return False
+            self.msleep(poll_ms)
+        return False
 
     def stop(self):
         self.running = False
@@ -0,0 +1,118 @@
+# Trace transfer helpers for the spectrum analyzer
+# The ASCII transfer sends ~15 bytes per point and is parsed in Python,
+# the binary REAL,32 transfer sends 4 bytes per point and is mapped directly into a NumPy array.
+# TraceReader - the live trace read of the app (trace and its cached frequency axis), used by the benchmark as well.
+
+from contextlib         import nullcontext
+from threading          import RLock
+
+import numpy as np
+
+
+def set_trace_format(vsa, binary: bool = True) -> bool:
+    '''
+    Set the trace transfer format of the spectrum analyzer.
+    :param vsa: pyvisa resource of the spectrum analyzer
+    :param binary: True - REAL,32 with swapped (little endian) byte order, False - ASCII
+    :return: True if the analyzer is in binary format (False if it fell back to ASCII)
+    '''
+    if vsa is None:
+        return False
+
+    if binary:
+        vsa.write(":FORM:DATA REAL,32")
+        # Little endian byte order (native order of the PC)
+        vsa.write(":FORM:BORD SWAP")
+    else:
+        vsa.write(":FORM:DATA ASCii")
+
+    # Verify the format (instruments without REAL,32 support stay in ASCII)
+    return vsa.query(":FORM:DATA?").strip().upper().startswith("REAL")
+
+
+def fetch_trace(vsa, binary: bool = True, trace: int = 1):
+    '''
+    Transfer the trace data from the spectrum analyzer without parsing it.
+    :param vsa: pyvisa resource of the spectrum analyzer
+    :param binary: True - REAL,32 block, False - ASCII values
+    :param trace: Trace number
+    :return: Raw trace data (bytes for binary, str for ASCII)
+    '''
+    if binary:
+        # IEEE 488.2 definite length block, return the payload bytes
+        return vsa.query_binary_values(f":TRACe:DATA? TRACE{trace}", datatype='s', container=bytes)
+    return vsa.query(f":TRACe:DATA? TRACE{trace}")
+
+
+def parse_trace(raw, binary: bool = True) -> np.ndarray:
+    '''
+    Parse the raw trace data returned by fetch_trace.
+    :param raw: Raw trace data (bytes for binary, str for ASCII)
+    :param binary: True - REAL,32 little endian, False - comma separated ASCII values
+    :return: Trace data (float32 for binary, float64 for ASCII)
+    '''
+    if binary:
+        # Map the block straight into a float32 array (no copy)
+        return np.frombuffer(raw, dtype='<f4')
+    return np.array(raw.strip().split(','), dtype=float)
+
+
+def read_trace(vsa, binary: bool = True, trace: int = 1) -> np.ndarray:
+    '''
+    Read the trace data from the spectrum analyzer.
+    :param vsa: pyvisa resource of the spectrum analyzer
+    :param binary: True - read a REAL,32 block, False - read ASCII values
+    :param trace: Trace number
+    :return: Trace data (float32 for binary, float64 for ASCII)
+    '''
+    return parse_trace(fetch_trace(vsa, binary, trace), binary)
+
+
+class TraceReader:
+    '''
+    Read the trace with its frequency axis (MHz), the axis is cached while the frequency settings are unchanged.
+    reader = TraceReader(vsa, binary=True, lock=vsa_lock)
+    p, f = reader.read()
+    reader.invalidate()     # After a frequency/span/RBW change (inside the lock of the write)
+    :param vsa: pyvisa resource of the spectrum analyzer
+    :param binary: Trace transfer format (see set_trace_format)
+    :param lock: Lock of the VISA session shared with other threads (e.g. the trace worker)
+    :param query: Query of the frequency settings, e.g. a logging query of the app (default vsa.query)
+    :param timing: StageTiming, the parsing is measured as 'parse' (None - not measured)
+    :param trace: Trace number
+    '''
+    def __init__(self, vsa, binary: bool = True, lock=None, query=None, timing=None, trace: int = 1):
+        self.vsa        = vsa
+        self.binary     = binary
+        self.lock       = lock if lock is not None else RLock()
+        self.query      = query if query is not None else (lambda cmd: vsa.query(cmd).strip())
+        self.timing     = timing
+        self.trace      = trace
+        self.freq_axis  = None  # Cached frequency axis (MHz), None - re-query the analyzer settings
+
+    def invalidate(self):
+        # The frequency settings changed, re-query the frequency axis on the next read
+        self.freq_axis  = None
+
+    def read(self):
+        '''
+        :return: p, f - trace data and its frequency axis (MHz)
+        '''
+        with self.lock:
+            # Query trace data (binary REAL,32 block or ASCII values)
+            raw = fetch_trace(self.vsa, self.binary, self.trace)
+            with self.timing.measure('parse') if self.timing is not None else nullcontext():
+                p = parse_trace(raw, self.binary)
+            # Build the frequency list (cached while the frequency settings are unchanged)
+            f = self.read_freq_axis(len(p))
+        return p, f
+
+    def read_freq_axis(self, num_points: int) -> np.ndarray:
+        # Re-query the frequency settings only if the cache was invalidated or the number of points changed
+        with self.lock:
+            if self.freq_axis is None or len(self.freq_axis) != num_points:
+                start_freq  = float(self.query(":FREQuency:START?" ))*1e-6
+                stop_freq   = float(self.query(":FREQuency:STOP?"  ))*1e-6
+                num_points  =   int(self.query(":SENSe:SWEep:POIN?"))
+                self.freq_axis = np.linspace(start_freq, stop_freq, num_points)
+            return self.freq_axis
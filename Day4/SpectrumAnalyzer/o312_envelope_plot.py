@@ -0,0 +1,212 @@
+# Plot widget that draws long traces as a per-pixel min/max envelope
+# A stitched hi-res scan has over a million points, but the plot is only ~1000 pixels wide.
+# Each pixel column is drawn as a vertical line from the minimum to the maximum of its points,
+# thus peaks (spurs) are preserved while only ~2 points per pixel are drawn.
+# The envelope is recomputed from a cached multi-resolution (min/max) pyramid when the user zooms.
+# Persistent curves (update_curve) are created once and later frames only replace their data,
+# redrawn by blitting over the cached background (axes, labels and title are not redrawn).
+
+import numpy as np
+
+from PyQt6.QtWidgets    import QWidget, QVBoxLayout
+
+from matplotlib.figure                  import Figure
+from matplotlib.backends.backend_qtagg  import FigureCanvasQTAgg, NavigationToolbar2QT
+
+
+def minmax_envelope(x: np.ndarray, y_min: np.ndarray, y_max: np.ndarray, x_lo: float, x_hi: float,
+                    n_pixels: int, xlog: bool = False):
+    '''
+    Reduce the points in the range [x_lo, x_hi] to a min/max envelope of n_pixels columns.
+    :param x: Sorted x values
+    :param y_min: Minimum of the y values at each x (equal to y_max for raw data)
+    :param y_max: Maximum of the y values at each x
+    :param x_lo: Start of the visible range
+    :param x_hi: End of the visible range
+    :param n_pixels: Number of pixel columns
+    :param xlog: Logarithmic x axis (log spaced pixel columns)
+    :return: x_env, y_env - interleaved (min, max) points of every non-empty pixel column
+    '''
+    # Raw data (not a pyramid level) is drawn as is when there is nothing to reduce
+    is_raw = y_min is y_max
+    # Visible points (and one point on each side, so the line continues to the edges)
+    i_lo = max(np.searchsorted(x, x_lo, side='left' ) - 1, 0)
+    i_hi = min(np.searchsorted(x, x_hi, side='right') + 1, len(x))
+    x, y_min, y_max = x[i_lo:i_hi], y_min[i_lo:i_hi], y_max[i_lo:i_hi]
+    if len(x) <= 2*n_pixels and is_raw:
+        # Nothing to reduce
+        return x, y_min
+
+    # Pixel column edges
+    if xlog:
+        edges = np.geomspace(max(x_lo, x[x > 0][0]), x_hi, n_pixels + 1)
+    else:
+        edges = np.linspace(x_lo, x_hi, n_pixels + 1)
+    # Index of the first point of each non-empty pixel column
+    starts = np.unique(np.searchsorted(x, edges[1:-1]))
+    starts = np.concatenate(([0], starts[(starts > 0) & (starts < len(x))]))
+    col_min = np.minimum.reduceat(y_min, starts)
+    col_max = np.maximum.reduceat(y_max, starts)
+    # Interleave the min and max of each column (vertical line per column)
+    x_env = np.repeat(x[starts], 2)
+    y_env = np.column_stack((col_min, col_max)).ravel()
+    return x_env, y_env
+
+
+class EnvelopePyramid:
+    '''
+    Multi-resolution min/max pyramid of a trace
+    Level 0 is the trace itself, every level reduces the previous one by a factor of 'factor'.
+    '''
+    def __init__(self, x: np.ndarray, y: np.ndarray, factor: int = 4, min_points: int = 2048):
+        x = np.asarray(x)
+        y = np.asarray(y)
+        self.levels = [(x, y, y)]
+        while len(x) > min_points:
+            starts = np.arange(0, len(x), factor)
+            x      = x[starts]
+            y_min  = np.minimum.reduceat(self.levels[-1][1], starts)
+            y_max  = np.maximum.reduceat(self.levels[-1][2], starts)
+            self.levels.append((x, y_min, y_max))
+
+    def envelope(self, x_lo: float, x_hi: float, n_pixels: int, xlog: bool = False):
+        '''
+        Min/max envelope of the visible range from the coarsest level that still has
+        at least 2 points per pixel column.
+        '''
+        for x, y_min, y_max in reversed(self.levels):
+            n_visible = np.searchsorted(x, x_hi, side='right') - np.searchsorted(x, x_lo, side='left')
+            if n_visible >= 2*n_pixels:
+                break
+        else:
+            x, y_min, y_max = self.levels[0]
+        return minmax_envelope(x, y_min, y_max, x_lo, x_hi, n_pixels, xlog)
+
+
+class EnvelopePlotWidget(QWidget):
+    '''
+    Matplotlib plot widget (same plot() arguments as python_rf_course_utils.qt.PlotWidget)
+    that draws every trace as a per-pixel min/max envelope.
+    update_curve() is the persistent curve API for live (timer) updates.
+    '''
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self.figure     = Figure()
+        self.canvas     = FigureCanvasQTAgg(self.figure)
+        self.toolbar    = NavigationToolbar2QT(self.canvas, self)
+        layout          = QVBoxLayout(self)
+        layout.addWidget(self.toolbar)
+        layout.addWidget(self.canvas)
+
+        self.ax         = None
+        self.xlog       = False
+        # Line object -> pyramid of its full resolution data
+        self.pyramids   = {}
+        # Persistent curves, name -> (line object, x data)
+        self.curves     = {}
+        # Figure without the persistent curves (blit background)
+        self.background = None
+        self.canvas.mpl_connect('draw_event', self.on_draw)
+        self.reset_axes()
+
+    def reset_axes(self):
+        self.figure.clf()
+        self.ax         = self.figure.add_subplot(111)
+        self.pyramids   = {}
+        self.curves     = {}
+        self.background = None
+        # Recompute the envelopes when the user zooms or pans
+        self.ax.callbacks.connect('xlim_changed', self.on_xlim_changed)
+
+    def set_background_color(self, color):
+        self.figure.set_facecolor(color)
+        self.canvas.draw_idle()
+
+    def get_y_range(self):
+        return self.ax.get_ylim()
+
+    def n_pixels(self) -> int:
+        # Width of the axes in pixels
+        return max(int(self.ax.bbox.width), 1)
+
+    def plot(self, x, y, line='b-', line_width=1.0, xlabel='', ylabel='', title='', xlog=False, clf=True,
+             legend=None, y_lim_min=None, y_lim_max=None):
+        if clf:
+            self.reset_axes()
+        self.xlog   = xlog
+        pyramid     = EnvelopePyramid(x, y)
+        x_env, y_env = pyramid.envelope(x[0], x[-1], self.n_pixels(), xlog)
+        h_line,     = self.ax.plot(x_env, y_env, line, linewidth=line_width, label=legend)
+        self.pyramids[h_line] = pyramid
+
+        if xlog:
+            self.ax.set_xscale('log')
+        self.ax.set_xlabel(xlabel)
+        self.ax.set_ylabel(ylabel)
+        self.ax.set_title(title)
+        self.ax.grid(True)
+        if legend is not None:
+            self.ax.legend()
+        if y_lim_min is not None and y_lim_max is not None:
+            self.ax.set_ylim(y_lim_min, y_lim_max)
+        self.canvas.draw_idle()
+        return h_line
+
+    def update_curve(self, name, x, y, **kwargs):
+        '''
+        Persistent curve - the first frame creates the curve (plot arguments in kwargs, clf=True),
+        later frames only replace the y data (and the x data if it is not the same array).
+        '''
+        if name not in self.curves:
+            h_line = self.plot(x, y, **kwargs)
+            # Drawn by on_draw/blit and not by the figure draw
+            h_line.set_animated(True)
+            self.curves[name] = (h_line, x)
+            return
+
+        h_line, x_curve = self.curves[name]
+        # Keep the pyramid current, a later zoom (on_xlim_changed) redraws it
+        pyramid         = EnvelopePyramid(x, y)
+        self.pyramids[h_line] = pyramid
+        if x is not x_curve and self.ax.get_autoscalex_on():
+            # New frequency axis, follow it (unless the user zoomed in)
+            self.ax.set_xlim(x[0], x[-1], auto=None)
+        x_lo, x_hi      = self.ax.get_xlim()
+        if x is x_curve and len(x) <= 2*self.n_pixels() and len(h_line.get_xdata()) == len(x):
+            # Same frequency axis, nothing to reduce and the line holds all of it (not zoomed), swap the y data only
+            h_line.set_ydata(y)
+        else:
+            h_line.set_data(*pyramid.envelope(x_lo, x_hi, self.n_pixels(), self.xlog))
+            self.curves[name] = (h_line, x)
+
+        # Rescale the y axis (unless it was zoomed) only if the data left the axis or uses less than half of it,
+        # so the noise of consecutive frames does not force a full redraw
+        limits = (self.ax.get_xlim(), self.ax.get_ylim())
+        if self.ax.get_autoscaley_on():
+            y_lo, y_hi  = self.ax.get_ylim()
+            y_min       = float(np.nanmin(y))
+            y_max       = float(np.nanmax(y))
+            if y_min < y_lo or y_max > y_hi or (y_max - y_min) < (y_hi - y_lo)/2:
+                margin  = max(y_max - y_min, 1.0)*0.1
+                self.ax.set_ylim(y_min - margin, y_max + margin, auto=None)
+        if self.background is None or limits != (self.ax.get_xlim(), self.ax.get_ylim()):
+            # Axes changed - full redraw
+            self.canvas.draw_idle()
+        else:
+            # Blit the curves over the cached background
+            self.canvas.restore_region(self.background)
+            for h_line, _ in self.curves.values():
+                self.ax.draw_artist(h_line)
+            self.canvas.blit(self.figure.bbox)
+
+    def on_draw(self, event):
+        # Cache the background (everything but the persistent curves) and draw the curves on it
+        self.background = self.canvas.copy_from_bbox(self.figure.bbox)
+        for h_line, _ in self.curves.values():
+            self.ax.draw_artist(h_line)
+
+    def on_xlim_changed(self, ax):
+        x_lo, x_hi = ax.get_xlim()
+        for h_line, pyramid in self.pyramids.items():
+            h_line.set_data(*pyramid.envelope(x_lo, x_hi, self.n_pixels(), self.xlog))
+        self.canvas.draw_idle()
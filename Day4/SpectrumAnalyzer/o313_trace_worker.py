@@ -0,0 +1,73 @@
+from PyQt6.QtCore       import QThread, pyqtSignal
+
+from threading          import Lock, Event
+from time               import perf_counter
+
+
+class TraceWorker(QThread):
+    '''
+    Background trace acquisition for the live refresh timer.
+    The worker reads traces in a loop and keeps only the latest frame in a single-slot mailbox,
+    stale frames are dropped, thus the GUI timer only renders and never waits for the instrument.
+    Adaptive mode (sweep_time is given) - a trace is read once per sweep of the analyzer,
+    the interval is the upper bound of the time between reads.
+    stop() interrupts the wait between reads at once, a trace read in progress is completed (up to the VISA
+    timeout), thus the GUI continues on the finished signal instead of wait().
+    '''
+    log         = pyqtSignal(str)
+    min_interval_ms = 20 # Fastest read rate (adaptive mode)
+
+    def __init__(self, read_frame, interval_ms:int=250, sweep_time=None):
+        super().__init__()
+        self.read_frame     = read_frame    # Callable returning a frame, e.g. (power, freq)
+        self.interval_ms    = interval_ms   # Time between reads (upper bound in adaptive mode)
+        self.sweep_time     = sweep_time    # Callable returning the sweep time (sec), None - fixed interval
+        self.mailbox        = None          # Latest frame (None - no new frame)
+        self.lock           = Lock()
+        self.n_dropped      = 0             # Frames overwritten before they were taken
+        self.running        = False
+        self.stop_event     = Event()       # Set by stop(), interrupts the wait between reads
+
+    def run(self):
+        # A stop() before the thread started is kept
+        self.running = not self.stop_event.is_set()
+        while self.running:
+            t_start = perf_counter()
+            try:
+                frame = self.read_frame()
+            except Exception as e:
+                self.log.emit(f"Thread: Trace read failed: {e}")
+                frame = None
+
+            if frame is not None:
+                # Keep only the latest frame
+                with self.lock:
+                    if self.mailbox is not None:
+                        self.n_dropped += 1
+                    self.mailbox = frame
+
+            # Wait for the rest of the interval
+            t_wait = self.next_interval() - int((perf_counter() - t_start)*1e3)
+            if t_wait > 0 and self.running:
+                self.stop_event.wait(t_wait*1e-3)
+
+    def next_interval(self) -> int:
+        if self.sweep_time is None:
+            return self.interval_ms
+        try:
+            t_sweep_ms = self.sweep_time()*1e3
+        except Exception as e:
+            self.log.emit(f"Thread: Sweep time query failed: {e}")
+            return self.interval_ms
+        # One read per sweep, bounded by the fastest read rate and the refresh interval
+        return int(min(max(t_sweep_ms, self.min_interval_ms), self.interval_ms))
+
+    def take(self):
+        # Get the latest frame and empty the mailbox
+        with self.lock:
+            frame, self.mailbox = self.mailbox, None
+        return frame
+
+    def stop(self):
+        self.running = False
+        self.stop_event.set()
@@ -1,5 +1,13 @@
 from PyQt6.QtCore       import QThread, pyqtSignal
 import numpy as np
+import pyvisa
+
+import os
+import sys
+
+# The SCPI batching helper is shared with the workshop PA app (Exercises/workshop/solution/scpi_batch.py)
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "..", "workshop", "solution"))
+from scpi_batch         import ScpiBatch
 
 
 class LongProcess(QThread):
@@ -7,12 +15,18 @@ class LongProcess(QThread):
     progress    = pyqtSignal(int)
     data        = pyqtSignal(np.ndarray, np.ndarray)
     log         = pyqtSignal(str)
+    # Shadowed settings (as spelled in the scan) and the commands that do not change them
+    sa_cached       = ("sense:FREQuency:CENTer", "sense:FREQuency:SPAN", "DISP:WIND:TRAC:Y:RLEV")
+    sa_transparent  = ("INITiate:IMMediate", "*OPC?", "CALCulate:MARKer:MAXimum")
+    sg_cached       = ("freq", ":OUTPUT:STATE", ":OUTPUT:MOD:STATE")
 
     def __init__(self, f_scan,scpi_sa, scpi_sg):
         super().__init__()
         self.f_scan     = f_scan
-        self.scpi_sa    = scpi_sa
-        self.scpi_sg    = scpi_sg
+        # The commands of a scan step are sent in batches (one message per round trip),
+        # unchanged settings are not rewritten and their queries are answered locally
+        self.scpi_sa    = ScpiBatch(scpi_sa, cached=self.sa_cached, transparent=self.sa_transparent)
+        self.scpi_sg    = ScpiBatch(scpi_sg, cached=self.sg_cached)
         
         self.running    = False
 
@@ -22,14 +36,16 @@ class LongProcess(QThread):
         self.log.emit("Thread: Starting scan")
 
         # Set RF output on
-        self.scpi_sg.write(":OUTPUT:STATE ON")
-        self.scpi_sg.write(":OUTPUT:MOD:STATE OFF")
-        # set the RBW
-        self.scpi_sa.write("sense:BANDwidth:RESolution 0.1 MHz")
-        self.scpi_sa.write("sense:DETEctor AVERage")
-        # Trace Clear/write mode
-        self.scpi_sa.write("TRACe:MODE WRITe")
-        self.scpi_sa.write("INITiate:CONTinuous OFF")
+        with self.scpi_sg.batch():
+            self.scpi_sg.write(":OUTPUT:STATE ON")
+            self.scpi_sg.write(":OUTPUT:MOD:STATE OFF")
+        with self.scpi_sa.batch():
+            # set the RBW
+            self.scpi_sa.write("sense:BANDwidth:RESolution 0.1 MHz")
+            self.scpi_sa.write("sense:DETEctor AVERage")
+            # Trace Clear/write mode
+            self.scpi_sa.write("TRACe:MODE WRITe")
+            self.scpi_sa.write("INITiate:CONTinuous OFF")
 
         # Create a list to store the scan data
         power = np.array([])
@@ -37,27 +53,29 @@ class LongProcess(QThread):
         for i, f in enumerate(self.f_scan):
             # Set the SG to the frequency of the current scan point
             self.scpi_sg.write(f"freq {f} MHz")
-            # Set the SA center frequency
-            self.scpi_sa.write(f"sense:FREQuency:CENTer {f} MHz")
-            # Set the span
-            self.scpi_sa.write(f"sense:FREQuency:SPAN 5 MHz")
-            # Initiate a single sweep
-            self.scpi_sa.write("INITiate:IMMediate")
-            try:
-                self.scpi_sa.query("*OPC?")
-            except pyvisa.errors.VisaIOError:
-                self.log.emit(f"Thread: OPC Failed at {f} MHz")
+            # The settings are sent with the sweep, the marker with its value
+            with self.scpi_sa.batch():
+                # Set the SA center frequency
+                self.scpi_sa.write(f"sense:FREQuency:CENTer {f} MHz")
+                # Set the span
+                self.scpi_sa.write(f"sense:FREQuency:SPAN 5 MHz")
+                # Initiate a single sweep
+                self.scpi_sa.write("INITiate:IMMediate")
+                try:
+                    self.scpi_sa.query("*OPC?")
+                except pyvisa.errors.VisaIOError:
+                    self.log.emit(f"Thread: OPC Failed at {f} MHz")
 
-            # Set marker to peak
-            self.scpi_sa.write("CALCulate:MARKer:MAXimum")
-            # Get the peak value
-            peak_value = float(self.scpi_sa.query("CALCulate:MARKer:Y?").strip())
-            # Set the reference level
-            max_level  = np.ceil( peak_value/10 + 1)*10
-            set_level  = float(self.scpi_sa.query(f"DISP:WIND:TRAC:Y:RLEV?").strip() )
-            if set_level != max_level:
-                self.log.emit(f"Thread: Setting reference level to {max_level}")
-                self.scpi_sa.write(f"DISP:WIND:TRAC:Y:RLEV {max_level}")
+                # Set marker to peak
+                self.scpi_sa.write("CALCulate:MARKer:MAXimum")
+                # Get the peak value
+                peak_value = float(self.scpi_sa.query("CALCulate:MARKer:Y?").strip())
+                # Set the reference level
+                max_level  = np.ceil( peak_value/10 + 1)*10
+                set_level  = float(self.scpi_sa.query(f"DISP:WIND:TRAC:Y:RLEV?").strip() )
+                if set_level != max_level:
+                    self.log.emit(f"Thread: Setting reference level to {max_level}")
+                    self.scpi_sa.write(f"DISP:WIND:TRAC:Y:RLEV {max_level}")
             # save the peak value and frequency
             power = np.append(power, peak_value)
             freq  = np.append(freq, f)
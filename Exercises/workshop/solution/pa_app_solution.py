@@ -9,9 +9,10 @@ import numpy as np
 
 from python_rf_course_utils.qt import h_gui, PlotWidget, setup_logger
 from python_rf_course_utils.scpi import wrapper
-from python_rf_course_utils.arb import multitone
 
-from pa_app_thread import PaScan
+from pa_app_thread import PaScan, PA_RESULTS_DTYPE, PA_RESULTS_HEADER
+from result_sink import ResultSink
+from scan_plot import ScanPlotWidget
 
 import pyvisa
 import pyvisa_py
@@ -19,6 +20,13 @@ import pyarbtools as arb
 
 import logging
 import time
+import os
+import sys
+
+# The multi-tone design and the ARB waveform cache of the Day 3 signal generator app
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "..", "..", "Day3", "DesignerAndMXG"))
+from o218_mutitone  import mutitone
+from o221_wfm_cache import WaveformCache
 
 def is_valid_ip(ip:str) -> bool:
     # Regular expression pattern for matching IP address
@@ -66,6 +74,7 @@ class PA_App(QMainWindow):
         self.sa         = None
         self.sg         = None
         self.arb        = None
+        self.wfm_cache  = None
 
         # Load the configuration/default values from the YAML file
         self.Params     = None
@@ -82,7 +91,9 @@ class PA_App(QMainWindow):
         self.h_gui['Ptx'].set_val(self.h_gui['Ptx'].get_val()) #  Update the signal (event)
 
         # Create a widget for the Spectrum Analyzer plot
-        self.plot_sa        = PlotWidget()
+        # Incremental plot - the scan metrics are persistent curves drawn at the display refresh rate
+        self.incremental    = self.Params.get('IncrementalPlot', True)
+        self.plot_sa        = ScanPlotWidget() if self.incremental else PlotWidget()
         layout              = QVBoxLayout(self.widget)
         layout.addWidget(self.plot_sa)
         # Change the background color of the plot to white
@@ -130,13 +141,15 @@ class PA_App(QMainWindow):
                 self.scpi_sg.write("*RST")
                 self.scpi_sg.write("*CLS")
                 # Load the arb with a two tone signal
-                sig = multitone(BW=self.Params['ArbFd'], Ntones=2,
-                                Fs=self.Params['ArbFs'], Nfft=2048)
+                # Deterministic phases, thus the same settings give the same waveform (found in the ARB memory)
+                sig, _, _ = mutitone(BW=self.Params['ArbFd'], Ntones=2,
+                                     Fs=self.Params['ArbFs'], Nfft=2048, phase='newman')
 
                 self.arb.configure(fs=self.Params['ArbFs']*1e6, iqScale=70 )
-                self.arb.download_wfm(sig, wfmID='TwoTones')
                 self.arb.set_alcState(0) # ALC Off (DO not use bool)
-                self.arb.play('TwoTones')
+                # Download only if the waveform is not in the ARB memory (e.g. a previous connection)
+                self.wfm_cache = WaveformCache(self.arb, max_samples=self.Params.get('ArbMemSamples', 8_000_000))
+                self.wfm_cache.play(sig, prefix='TwoTones')
                 # Set the signal generator to output power
                 self.scpi_sg.write(f":POW:LEV {self.h_gui["Ptx"].get_val()} dBm")
                 # Set the spectrum analyzer span and RBW detector AVG and trace to clear/write
@@ -242,6 +255,10 @@ class PA_App(QMainWindow):
 
     # thread callback functions
     def tcb_plot(self, freq, power, clf= True,legend='Gain',color='b-'):
+        if self.incremental:
+            # The points so far (views of the scan results), the curve is drawn on the next frame
+            self.plot_sa.update_series(legend, freq, power, line=color, line_width=6.0)
+            return
         freq_v  = self.f_scan
         power_v = np.concatenate((power, np.ones(len(freq_v)-len(power))*power[0]))
         self.plot_sa.plot( freq_v , power_v,
@@ -272,14 +289,35 @@ class PA_App(QMainWindow):
                 self.f_scan = np.linspace(self.h_gui['Fstart' ].get_val(),
                                           self.h_gui['Fstop'  ].get_val(),
                                           self.h_gui['Npoints'].get_val())
-
+                if self.incremental:
+                    # Empty plot over the whole scan, the curves grow into it
+                    self.plot_sa.start_scan(self.f_scan[0], self.f_scan[-1], xlabel='Frequency (MHz)',
+                                            ylabel='Power dBm', title='Filter response')
+
+                # Streaming results file, the points are saved as they are measured
+                sink = None
+                if self.Params.get('StreamResults', True):
+                    # Continue an interrupted scan from its file (once), or a new file
+                    resume_file = self.Params.get('ResumeFile', None)
+                    self.Params['ResumeFile'] = None
+                    csv_file    = resume_file or f"PA_Scan_{time.strftime('%Y%m%d_%H%M%S')}.csv"
+                    sink        = ResultSink(csv_file, PA_RESULTS_DTYPE, header=PA_RESULTS_HEADER,
+                                             resume=resume_file is not None,
+                                             fsync_s=self.Params.get('FsyncInterval', 2.0),
+                                             npz=self.Params.get('ResultsNpz', False))
+                    self.log.info(f"Data saved to {csv_file}")
 
                 # Create the thread object
-                self.thread = PaScan(f_scan=self.f_scan, scpi_sa=self.scpi_sa,scpi_sg=self.scpi_sg, loss= self.Params['Loss']) # Create the thread object
+                self.thread = PaScan(f_scan=self.f_scan, scpi_sa=self.scpi_sa,scpi_sg=self.scpi_sg, loss= self.Params['Loss'],
+                                     concurrent=self.Params.get('ConcurrentIO', True),
+                                     model_op1db=self.Params.get('ModelOP1dB', True),
+                                     trace_imd=self.Params.get('TraceIMD', True),
+                                     sink=sink) # Create the thread object
                 self.thread.progress.connect(self.tcb_progress  )
                 self.thread.data    .connect(self.tcb_plot      )
                 self.thread.log     .connect(self.log.info      )
-                self.thread.csv     .connect(self.tcb_dump_csv  )
+                if sink is None:
+                    self.thread.csv .connect(self.tcb_dump_csv  )
                 # Connect to LCD real time display
                 self.thread.lcd_g    .connect(self.h_gui['ScanG'     ].set_val)
                 self.thread.lcd_op1dB.connect(self.h_gui['ScanOP1dB' ].set_val)
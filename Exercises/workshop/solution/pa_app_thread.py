@@ -1,5 +1,68 @@
 from PyQt6.QtCore       import QThread, pyqtSignal
 import numpy as np
+import pyvisa
+
+from concurrent.futures import ThreadPoolExecutor
+
+from scpi_batch         import ScpiBatch
+
+# PA scan results table, one row per scan point
+PA_RESULTS_DTYPE = np.dtype([('freq', float), ('gain', float), ('op1dB', float), ('oip3', float), ('oip5', float)])
+PA_RESULTS_HEADER = "Frequency (MHz), Gain (dB), OP1dB (dBm), OIP3 (dBm), OIP5 (dBm)"
+
+def peak_fit(freq, p_dbm, i, half_width, f_at=None):
+    '''
+    Least squares parabola (in dB) through the bins i-half_width..i+half_width of a peak,
+    exact for a Gaussian RBW filter, the noise of the bins is averaged (no snapping to a bin)
+    :param f_at: Frequency the parabola is evaluated at, None - at its vertex
+    :return: frequency, power (dBm) of the peak
+    '''
+    lo, hi  = max(i - half_width, 0), min(i + half_width + 1, len(p_dbm))
+    if hi - lo < 3:
+        return freq[i], p_dbm[i]
+    df      = freq[1] - freq[0]
+    a, b, c = np.polyfit((freq[lo:hi] - freq[i])/df, p_dbm[lo:hi], 2)
+    if f_at is not None:
+        u = (f_at - freq[i])/df
+    elif a < 0:
+        u = float(np.clip(-b/(2*a), -half_width, half_width))
+    else:
+        # Not a peak (noise), the bin itself
+        return freq[i], p_dbm[i]
+    return freq[i] + u*df, a*u*u + b*u + c
+
+
+def two_tone_imd(freq, p_dbm, half_width=2):
+    '''
+    Find the two tones and the upper IM3 and IM5 products in a trace
+    :param freq: Frequency axis of the trace
+    :param p_dbm: Trace (dBm)
+    :param half_width: Bins on each side of a peak in its fit (about RBW/2)
+    :return: power (dBm) of the strongest tone, IM3 and IM5
+    '''
+    p_dbm   = np.asarray(p_dbm, dtype=float)
+    i1      = int(np.argmax(p_dbm))
+    # Main lobe of the first tone (down to where the trace stops falling)
+    lo      = i1
+    while lo > 0 and p_dbm[lo - 1] < p_dbm[lo]:
+        lo -= 1
+    hi      = i1
+    while hi < len(p_dbm) - 1 and p_dbm[hi + 1] < p_dbm[hi]:
+        hi += 1
+    outside = p_dbm.copy()
+    outside[lo:hi + 1] = -np.inf
+    i2      = int(np.argmax(outside))
+    (f1, p1), (f2, _) = peak_fit(freq, p_dbm, i1, half_width), peak_fit(freq, p_dbm, i2, half_width)
+    f_sub_h, f_sub_l = max(f1, f2), min(f1, f2)
+
+    def product(f_product):
+        # The products are at known frequencies, the fit is evaluated there (no search for a noise maximum)
+        i = int(np.argmin(np.abs(freq - f_product)))
+        return peak_fit(freq, p_dbm, i, half_width, f_at=f_product)[1]
+
+    # IM3 at sub_h + (sub_h - sub_l), IM5 at sub_h + 2*(sub_h - sub_l)
+    return p1, product(2*f_sub_h - f_sub_l), product(3*f_sub_h - 2*f_sub_l)
+
 
 class PaScan(QThread):
     # Define signals as class attributes (for progressbar and returned data)
@@ -13,66 +76,125 @@ class PaScan(QThread):
     lcd_oip3   = pyqtSignal(float)
     lcd_oip5   = pyqtSignal(float)
     lcd_p_out  = pyqtSignal(float) # Power out
+    # Shadowed settings (as spelled in the scan) and the commands that do not change them
+    sa_cached       = ("sense:FREQuency:CENTer", "DISP:WIND:TRAC:Y:RLEV")
+    sa_transparent  = ("INITiate:IMMediate", "*OPC?", "CALCulate:MARKer:MAXimum", "CALCulate:MARKer:MAXimum:NEXT",
+                       "CALCulate:MARKer:X")
+    sg_cached       = ("POW:LEV", "freq", ":OUTPUT:MOD:STATE", ":OUTPUT:STATE")
+    sg_transparent  = ()
 
-    def __init__(self, f_scan,scpi_sa, scpi_sg, loss = 0):
+    def __init__(self, f_scan,scpi_sa, scpi_sg, loss = 0, concurrent=False, model_op1db=False, trace_imd=False,
+                 sink=None):
         super().__init__()
         self.f_scan     = f_scan
-        self.scpi_sa    = scpi_sa
-        self.scpi_sg    = scpi_sg
+        # The commands of a scan step are sent in batches (one message per round trip),
+        # unchanged settings are not rewritten and their queries are answered locally
+        self.scpi_sa    = ScpiBatch(scpi_sa, cached=self.sa_cached, transparent=self.sa_transparent)
+        self.scpi_sg    = ScpiBatch(scpi_sg, cached=self.sg_cached, transparent=self.sg_transparent)
         self.loss       = loss
-        
+        # Concurrent mode - the SG is set by its own I/O thread while the scan thread tunes the SA
+        self.concurrent = concurrent
+        self.io_sg      = None
+        # OP1dB search - True: compression model fit (warm started), False: bisection
+        self.model_op1db = model_op1db
+        self.p1db_in    = None  # SG power (dBm) of the 1 dB compression at the previous frequency
+        self.n_sweeps   = 0
+        # OIP3/OIP5 - True: from a single binary trace transfer, False: marker round trips
+        self.trace_imd  = trace_imd
+        self.results    = None  # Results table (PA_RESULTS_DTYPE), the first n_points rows are filled
+        self.n_points   = 0
+        self.span       = None  # Hz SA span (trace frequency axis)
+        self.rbw        = None  # Hz SA RBW (peak fit width)
+        # Streaming results file (ResultSink), every point is appended as it is measured, None - no file
+        self.sink       = sink
+
         self.running    = False
 
     def run(self):
+        # SG I/O thread (a single worker, thus the SG commands stay in order)
+        self.io_sg = ThreadPoolExecutor(max_workers=1, thread_name_prefix="PaScan-SG") if self.concurrent else None
+        try:
+            self.scan()
+        finally:
+            if self.sink is not None:
+                self.sink.close()
+            if self.trace_imd:
+                # Back to the ASCII trace format of the app
+                self.scpi_sa.write(":FORM:DATA ASCii")
+            if self.io_sg is not None:
+                self.io_sg.shutdown()
+                self.io_sg = None
+
+    def scan(self):
         # Save the instrument attributes for recall at the end of the scan
         self.running = True
         self.log.emit("Thread: Starting scan")
+        self.p1db_in    = None
+        self.n_sweeps   = 0
 
         # Set RF output on
         self.scpi_sg.write(":OUTPUT:STATE ON")
-        self.scpi_sa.write("sense:DETEctor AVERage")
-        # Trace Clear/write mode
-        self.scpi_sa.write("TRACe:MODE WRITe")
-        self.scpi_sa.write("INITiate:CONTinuous OFF")
+        with self.scpi_sa.batch():
+            self.scpi_sa.write("sense:DETEctor AVERage")
+            # Trace Clear/write mode
+            self.scpi_sa.write("TRACe:MODE WRITe")
+            self.scpi_sa.write("INITiate:CONTinuous OFF")
+            if self.trace_imd:
+                # Binary (REAL,32 little endian) trace transfer
+                self.scpi_sa.write(":FORM:DATA REAL,32")
+                self.scpi_sa.write(":FORM:BORD SWAP")
+                self.span = float(self.scpi_sa.query("sense:FREQuency:SPAN?"))
+                self.rbw  = float(self.scpi_sa.query("sense:BANDwidth:RESolution?"))
 
         p_tx_nominal = float(self.scpi_sg.query("POW:LEV?"))
 
-        # Create a list to store the scan data
-        gain    = np.array([])
-        op1dB   = np.array([])
-        oip3    = np.array([])
-        oip5    = np.array([])
-
-        freq    = np.array([])
+        # Preallocate the results table (NaN - not measured)
+        self.results    = np.full(len(self.f_scan), np.nan, dtype=PA_RESULTS_DTYPE)
+        self.n_points   = 0
+        # Points measured by an interrupted scan (resumed results file)
+        resumed = self.sink.open() if self.sink is not None else np.empty(0, dtype=PA_RESULTS_DTYPE)
+        if not np.isclose(resumed['freq'][:, np.newaxis], self.f_scan).any(axis=1).all():
+            # Rows of another scan (e.g. other Fstart/Fstop), the new rows would be mixed with them
+            self.log.emit(f"Thread: {self.sink.file_name} frequencies do not match the scan, not resumed")
+            return
+        n_resumed = 0
         for i, f in enumerate(self.f_scan):
+            # The row of the scan point (a view, the assignments fill the table)
+            row = self.results[i]
+            j   = np.flatnonzero(np.isclose(resumed['freq'], f))
+            if len(j):
+                # Already in the results file
+                self.results[i] = resumed[j[-1]]
+                self.n_points   = i + 1
+                n_resumed      += 1
+                self.emit_point(i)
+                continue
             # Set the SG to the frequency of the current scan point and power level
             p_tx = p_tx_nominal - 5 # Check gain at low power
-            self.scpi_sg.write(f"POW:LEV {p_tx}")
-            self.scpi_sg.write(f"freq {f} MHz")
-
-            # Set the SA center frequency
-            self.scpi_sa.write(f"sense:FREQuency:CENTer {f} MHz")
-
-            # Small signal gain
-            self.scpi_sg.write(":OUTPUT:MOD:STATE OFF") # Modulation off
-            peak_value = self.sa_sweep_marker_max()
+            with self.scpi_sa.batch():
+                # Set the SG and the SA center frequency
+                self.tune(f, p_tx)
+                peak_value = self.sa_sweep_marker_max()
 
-            # Set the reference level
-            max_level  = np.ceil( peak_value/10 + 1)*10
-            set_level  = float(self.scpi_sa.query(f"DISP:WIND:TRAC:Y:RLEV?") )
-            if set_level != max_level:
-                self.log.emit(f"Thread: Setting reference level to {max_level}")
-                self.scpi_sa.write(f"DISP:WIND:TRAC:Y:RLEV {max_level}")
+                # Set the reference level
+                max_level  = np.ceil( peak_value/10 + 1)*10
+                set_level  = float(self.scpi_sa.query(f"DISP:WIND:TRAC:Y:RLEV?") )
+                if set_level != max_level:
+                    self.log.emit(f"Thread: Setting reference level to {max_level}")
+                    self.scpi_sa.write(f"DISP:WIND:TRAC:Y:RLEV {max_level}")
             # save the peak value and frequency
             gain_i = peak_value + self.loss - p_tx
-            gain = np.append(gain, gain_i)
-            freq  = np.append(freq, f)
+            row['gain'] = gain_i
+            row['freq'] = f
             # Update the Gain LCD
             self.lcd_g.emit(gain_i)
             self.lcd_p_out.emit(peak_value + self.loss)
             # OP1dB
-            op1dB_i = self.find_op1db_binary_search(p_tx_nominal - 6, p_tx_nominal + 5, gain[-1])
-            op1dB   = np.append(op1dB, op1dB_i)
+            if self.model_op1db:
+                op1dB_i = self.find_op1db_model(p_tx_nominal - 6, p_tx_nominal + 5, gain_i)
+            else:
+                op1dB_i = self.find_op1db_binary_search(p_tx_nominal - 6, p_tx_nominal + 5, gain_i)
+            row['op1dB'] = op1dB_i
             self.lcd_op1dB.emit(op1dB_i)
             # # Slow scan increase power by 0.1 dB Gheck the gain drop until it is 1 dB
             # for p_tx in np.arange(p_tx_nominal - 3, p_tx_nominal + 5, 0.1):
@@ -94,51 +216,79 @@ class PaScan(QThread):
 
             # OIP3 and OIP5
             # Modulation On and tx power to nominal
-            self.scpi_sg.write(":OUTPUT:MOD:STATE ON")
-            self.scpi_sg.write(f"POW:LEV {p_tx_nominal}")
-            peak_value = self.sa_sweep_marker_max()
-            p_i        = peak_value + self.loss
-            # Get the frequency of subcarrier 1
-            freq_sig1  = float(self.scpi_sa.query("CALCulate:MARKer:X?"))
-            # Next peak twice (OIP3)
-            self.scpi_sa.write("CALCulate:MARKer:MAXimum:NEXT")
-            # Get the frequency of subcarrier 2
-            freq_sig2  = float(self.scpi_sa.query("CALCulate:MARKer:X?"))
-            f_sub_h = max(freq_sig1, freq_sig2)
-            f_sub_l = min(freq_sig1, freq_sig2)
-            # Set the marker to OIP3 (sub_h + (sub_h - sub_l))
-            f_oip3 = f_sub_h + (f_sub_h - f_sub_l)
-            self.scpi_sa.write(f"CALCulate:MARKer:X {f_oip3} Hz")
-            # Get the peak value
-            peak_value = float(self.scpi_sa.query("CALCulate:MARKer:Y?"))
-            p_i3        = peak_value + self.loss
-            # Next peak twice (OIP5)
-            f_oip5 = f_sub_h + (f_sub_h - f_sub_l)*2
-            self.scpi_sa.write(f"CALCulate:MARKer:X {f_oip5} Hz")
-            # Get the peak value
-            peak_value = float(self.scpi_sa.query("CALCulate:MARKer:Y?"))
-            p_i5        = peak_value + self.loss
+            self.sg_settle(":OUTPUT:MOD:STATE ON", f"POW:LEV {p_tx_nominal}")
+            if self.trace_imd:
+                # One sweep and one trace transfer, the tones and the products are found in the trace
+                p_i, p_i3, p_i5 = self.sa_sweep_imd(f)
+            else:
+                p_i, p_i3, p_i5 = self.sa_marker_imd()
 
             oip3_i = p_i + (p_i - p_i3)/2
             oip5_i = p_i + (p_i - p_i5)/4
-            oip3 = np.append(oip3, oip3_i)
-            oip5 = np.append(oip5, oip5_i)
+            row['oip3'] = oip3_i
+            row['oip5'] = oip5_i
+            self.n_points = i + 1
             self.lcd_oip3.emit(oip3_i)
             self.lcd_oip5.emit(oip5_i)
+            if self.sink is not None:
+                self.sink.append(row)
 
-            # if i%10==0:
-            self.data.emit(freq, gain , True , f"Gain" , 'k')
-            self.data.emit(freq, op1dB, False, f"OP1dB", 'b')
-            self.data.emit(freq, oip3 , False, f"OIP3" , 'g')
-            self.data.emit(freq, oip5 , False, f"OIP5" , 'r')
-
-            # Update the progress bar
-            self.progress.emit(100 * (i + 1) // len(self.f_scan))
+            self.emit_point(i)
             if not self.running:
                 break
 
+        if n_resumed:
+            self.log.emit(f"Thread: {n_resumed} points resumed from {self.sink.file_name}")
         # Dump the data to a CSV file
-        self.csv.emit(freq, gain, op1dB, oip3, oip5)
+        self.log.emit(f"Thread: Scan done, {self.n_sweeps} sweeps ({self.n_sweeps/max(self.n_points, 1):.1f} per point)")
+        done = self.results[:self.n_points]
+        self.csv.emit(done['freq'], done['gain'], done['op1dB'], done['oip3'], done['oip5'])
+
+    def emit_point(self, i):
+        # Views of the filled rows (no copies, the rows are not changed after they are filled)
+        done = self.results[:self.n_points]
+        self.data.emit(done['freq'], done['gain'] , True , f"Gain" , 'k')
+        self.data.emit(done['freq'], done['op1dB'], False, f"OP1dB", 'b')
+        self.data.emit(done['freq'], done['oip3'] , False, f"OIP3" , 'g')
+        self.data.emit(done['freq'], done['oip5'] , False, f"OIP5" , 'r')
+
+        # Update the progress bar
+        self.progress.emit(100 * (i + 1) // len(self.f_scan))
+
+    def tune(self, f, p_tx):
+        '''
+        Set the SG (power, frequency, modulation off) and the SA center frequency of a scan point
+        Sequential mode - the SG is set first (and waits for its *OPC?), the SA center frequency is queued
+        and sent with the sweep.
+        Concurrent mode - the SA is tuned while the SG worker sets the SG, both wait for their *OPC?,
+        thus both are settled before the sweep (barrier).
+        '''
+        def sg_setup():
+            with self.scpi_sg.batch(opc=True):
+                self.scpi_sg.write(f"POW:LEV {p_tx}")
+                self.scpi_sg.write(f"freq {f} MHz")
+                # Small signal gain
+                self.scpi_sg.write(":OUTPUT:MOD:STATE OFF") # Modulation off
+
+        if self.io_sg is None:
+            sg_setup()
+            self.scpi_sa.write(f"sense:FREQuency:CENTer {f} MHz")
+            return
+        sg_done = self.io_sg.submit(sg_setup)
+        self.scpi_sa.write(f"sense:FREQuency:CENTer {f} MHz")
+        if self.scpi_sa.queue:
+            self.scpi_sa.flush(opc=True)
+        # Barrier - the SG is settled (an SG exception is raised here)
+        sg_done.result()
+
+    def sg_settle(self, *cmds):
+        '''
+        Set the SG before a sweep - the commands are sent with *OPC? and the response is awaited,
+        thus the SG is settled before the SA (another socket) sweeps (barrier)
+        '''
+        with self.scpi_sg.batch(opc=True):
+            for cmd in cmds:
+                self.scpi_sg.write(cmd)
 
     def find_op1db_binary_search(self, p_tx_start, p_tx_end, gain_ref, resolution=0.1):
         low     = p_tx_start
@@ -149,7 +299,7 @@ class PaScan(QThread):
             mid = (low + high) / 2
 
             # Set the power level and measure gain
-            self.scpi_sg.write(f"POW:LEV {mid}")
+            self.sg_settle(f"POW:LEV {mid}")
             peak_value  = self.sa_sweep_marker_max()
             gain_i      = peak_value + self.loss - mid
             gain_diff   = gain_ref - gain_i
@@ -167,23 +317,131 @@ class PaScan(QThread):
         # Final measurement at the determined power level
         if op1dB_i is None:
             # If we didn't find a point with 1dB compression, use the highest power
-            self.scpi_sg.write(f"POW:LEV {high}")
+            self.sg_settle(f"POW:LEV {high}")
             peak_value  = self.sa_sweep_marker_max()
             op1dB_i     = peak_value + self.loss
 
         return op1dB_i
 
+    @staticmethod
+    def predict_p1db(p_tx, compression, smoothness=2.0):
+        '''
+        Fit the Rapp AM/AM model to the measured compression points and predict the 1 dB compression input power.
+        In dB the Rapp compression is c(p) = 10/s*log10(1 + 10^(s*(p - p_sat)/10)), each point gives p_sat for a
+        smoothness s, the smoothness with the most consistent p_sat is used (fixed if there is a single point).
+        :param p_tx: SG powers (dBm) of the points
+        :param compression: Gain compression (dB) of the points
+        :param smoothness: Rapp smoothness of a single point fit
+        :return: SG power (dBm) of the 1 dB compression
+        '''
+        p_tx        = np.asarray(p_tx, dtype=float)
+        # Points in the noise (no or negative compression) are pulled to a small compression
+        c           = np.maximum(np.asarray(compression, dtype=float), 0.02)
+        s           = np.array([smoothness]) if len(p_tx) < 2 else np.linspace(0.5, 8.0, 76)[:, np.newaxis]
+        p_sat       = p_tx - 10/s*np.log10(10**(c*s/10) - 1)
+        best        = np.argmin(np.var(p_sat, axis=-1)) if len(p_tx) >= 2 else 0
+        s           = float(np.ravel(s)[best])
+        p_sat       = float(np.mean(np.atleast_2d(p_sat)[best]))
+        return p_sat + 10/s*np.log10(10**(s/10) - 1)
+
+    def find_op1db_model(self, p_tx_start, p_tx_end, gain_ref, tolerance=0.1, max_step=6.0, max_sweeps=8):
+        '''
+        Model guided OP1dB search - start at the 1 dB compression power of the previous frequency (warm start),
+        fit the compression model to the points measured so far, jump to the predicted 1 dB power and repeat
+        until the measured compression is within the tolerance of 1 dB (confirmed by a measurement).
+        Falls back to the bisection if it does not converge.
+        '''
+        p_mid   = (p_tx_start + p_tx_end)/2
+        p       = p_mid if self.p1db_in is None else float(np.clip(self.p1db_in, p_tx_start, p_tx_end))
+        points  = [] # (p_tx, compression, output power)
+        for _ in range(max_sweeps):
+            # Set the power level and measure the compression
+            self.sg_settle(f"POW:LEV {p}")
+            peak_value  = self.sa_sweep_marker_max()
+            p_out       = peak_value + self.loss
+            points.append((p, gain_ref - (p_out - p), p_out))
+            self.lcd_p_out.emit(p_out)
+            if abs(points[-1][1] - 1) <= tolerance:
+                # Confirmed
+                self.p1db_in = p
+                return p_out
+            if p >= p_tx_end and points[-1][1] < 1:
+                # No 1 dB compression in the window, use the highest power (as the bisection)
+                return p_out
+
+            # Jump to the predicted 1 dB power (limited step, within the window)
+            p_tx, compression, _ = zip(*points)
+            p_next  = self.predict_p1db(p_tx, compression)
+            p_next  = float(np.clip(p_next, p - max_step, p + max_step))
+            p_next  = float(np.clip(p_next, p_tx_start, p_tx_end))
+            if min(abs(p_next - q) for q in p_tx) < 0.01:
+                # The model does not move any more
+                break
+            p       = p_next
+
+        self.log.emit("Thread: OP1dB model did not converge, bisection")
+        op1dB_i         = self.find_op1db_binary_search(p_tx_start, p_tx_end, gain_ref)
+        self.p1db_in    = None
+        return op1dB_i
+
+    def sa_marker_imd(self):
+        # Every marker move is sent with the query that reads it
+        with self.scpi_sa.batch():
+            peak_value = self.sa_sweep_marker_max()
+            p_i        = peak_value + self.loss
+            # Get the frequency of subcarrier 1
+            freq_sig1  = float(self.scpi_sa.query("CALCulate:MARKer:X?"))
+            # Next peak twice (OIP3)
+            self.scpi_sa.write("CALCulate:MARKer:MAXimum:NEXT")
+            # Get the frequency of subcarrier 2
+            freq_sig2  = float(self.scpi_sa.query("CALCulate:MARKer:X?"))
+            f_sub_h = max(freq_sig1, freq_sig2)
+            f_sub_l = min(freq_sig1, freq_sig2)
+            # Set the marker to OIP3 (sub_h + (sub_h - sub_l))
+            f_oip3 = f_sub_h + (f_sub_h - f_sub_l)
+            self.scpi_sa.write(f"CALCulate:MARKer:X {f_oip3} Hz")
+            # Get the peak value
+            peak_value = float(self.scpi_sa.query("CALCulate:MARKer:Y?"))
+            p_i3        = peak_value + self.loss
+            # Next peak twice (OIP5)
+            f_oip5 = f_sub_h + (f_sub_h - f_sub_l)*2
+            self.scpi_sa.write(f"CALCulate:MARKer:X {f_oip5} Hz")
+            # Get the peak value
+            peak_value = float(self.scpi_sa.query("CALCulate:MARKer:Y?"))
+            p_i5        = peak_value + self.loss
+        return p_i, p_i3, p_i5
+
+    def sa_sweep_imd(self, f):
+        self.n_sweeps += 1
+        with self.scpi_sa.batch():
+            # Initiate a single sweep
+            self.scpi_sa.write("INITiate:IMMediate")
+            try:
+                self.scpi_sa.query("*OPC?")
+            except pyvisa.errors.VisaIOError:
+                self.log.emit(f"Thread: OPC Failed at {f} MHz")
+            trace = self.scpi_sa.query_binary(":TRACe:DATA? TRACE1")
+        # Trace frequency axis (the SA is centered at the scan frequency)
+        freq = np.linspace(f*1e6 - self.span/2, f*1e6 + self.span/2, len(trace))
+        # Peaks are fitted over +-RBW/2 (the -3 dB width of the RBW filter)
+        half_width = max(int(round(self.rbw/2/(freq[1] - freq[0]))), 1)
+        p_i, p_i3, p_i5 = two_tone_imd(freq, trace, half_width)
+        return p_i + self.loss, p_i3 + self.loss, p_i5 + self.loss
+
     def sa_sweep_marker_max(self):
-        # Initiate a single sweep
-        self.scpi_sa.write("INITiate:IMMediate")
-        try:
-            self.scpi_sa.query("*OPC?")
-        except pyvisa.errors.VisaIOError:
-            self.log.emit(f"Thread: OPC Failed at {f} MHz")
-        # Set marker to peak
-        self.scpi_sa.write("CALCulate:MARKer:MAXimum")
-        # Get the peak value
-        peak_value = float(self.scpi_sa.query("CALCulate:MARKer:Y?"))
+        self.n_sweeps += 1
+        # Two round trips - the sweep with its completion, the peak marker with its value
+        with self.scpi_sa.batch():
+            # Initiate a single sweep
+            self.scpi_sa.write("INITiate:IMMediate")
+            try:
+                self.scpi_sa.query("*OPC?")
+            except pyvisa.errors.VisaIOError:
+                self.log.emit("Thread: OPC Failed")
+            # Set marker to peak
+            self.scpi_sa.write("CALCulate:MARKer:MAXimum")
+            # Get the peak value
+            peak_value = float(self.scpi_sa.query("CALCulate:MARKer:Y?"))
 
         return peak_value
 
@@ -0,0 +1,115 @@
+# Streaming results file of a scan
+# The rows are appended to a CSV file as soon as they are measured (not dumped at the end of the scan),
+# the file is flushed and synced to the disk periodically, thus a crash loses at most the last few rows.
+# An interrupted scan is resumed from its partial file - the rows in the file are read back
+# (a row torn by the crash is cut off) and the scan measures only the missing points.
+# Optional columnar NPZ copy of the table (np.load(file)['gain'], ...) written at the end of the scan.
+
+import os
+
+from time               import perf_counter
+
+import numpy as np
+
+
+class ResultSink:
+    '''
+    Append-only CSV file of a results table (one column per field of the dtype)
+    sink = ResultSink("PA_Scan.csv", PA_RESULTS_DTYPE, resume=True)
+    done = sink.open()      # rows already in the file (resume), empty for a new file
+    sink.append(row)        # per scan point
+    sink.close()
+    :param file_name: CSV file
+    :param dtype: Structured dtype of a row
+    :param header: CSV header line, None - the field names
+    :param resume: True - continue an existing file, False - a new file (an existing one is overwritten)
+    :param fsync_s: Time between syncs to the disk (sec), 0 - sync every row
+    :param npz: Write the table as NPZ (same name, .npz) when the sink is closed
+    '''
+    def __init__(self, file_name:str, dtype:np.dtype, header:str=None, resume:bool=False, fsync_s:float=2.0,
+                 npz:bool=False):
+        self.file_name  = file_name
+        self.dtype      = np.dtype(dtype)
+        self.header     = header if header is not None else ", ".join(self.dtype.names)
+        self.resume     = resume
+        self.fsync_s    = fsync_s
+        self.npz        = npz
+        self.file       = None
+        self.rows       = []    # All the rows of the file (tuples)
+        self.t_sync     = 0.0
+
+    def open(self) -> np.ndarray:
+        '''
+        Open the file for appending
+        :return: The rows already in the file (resume), in the order they were written
+        '''
+        self.rows = []
+        if self.resume and os.path.exists(self.file_name):
+            self.rows, n_valid = self.read_rows()
+            # Cut off a row torn by the crash (the next row is appended after the last complete one)
+            with open(self.file_name, "r+b") as f:
+                f.truncate(n_valid)
+            self.file = open(self.file_name, "a")
+        else:
+            self.file = open(self.file_name, "w")
+            self.file.write(self.header + "\n")
+            self.sync()
+        return np.array(self.rows, dtype=self.dtype)
+
+    def read_rows(self):
+        '''
+        Complete rows of the file
+        :return: rows (tuples), length (bytes) of the header and the complete rows
+        '''
+        with open(self.file_name, "rb") as f:
+            data = f.read()
+        n_fields = len(self.dtype.names)
+        rows     = []
+        # The header line is not a row
+        n_valid  = data.find(b"\n") + 1
+        if n_valid == 0:
+            raise ValueError(f"{self.file_name}: no header line")
+        while True:
+            end = data.find(b"\n", n_valid)
+            if end < 0:
+                # Last line without its end of line - torn
+                break
+            fields = data[n_valid:end].decode().split(",")
+            try:
+                if len(fields) != n_fields:
+                    raise ValueError
+                rows.append(tuple(float(v) for v in fields))
+            except ValueError:
+                break
+            n_valid = end + 1
+        return rows, n_valid
+
+    def append(self, row):
+        '''
+        Append a row (a row of the results table or a tuple in field order), synced every fsync_s
+        '''
+        values = tuple(float(v) for v in (row.item() if isinstance(row, np.void) else row))
+        self.rows.append(values)
+        self.file.write(",".join(repr(v) for v in values) + "\n")
+        if perf_counter() - self.t_sync >= self.fsync_s:
+            self.sync()
+
+    def sync(self):
+        # Python buffer to the OS, and the OS cache to the disk
+        self.file.flush()
+        os.fsync(self.file.fileno())
+        self.t_sync = perf_counter()
+
+    def close(self):
+        if self.file is None:
+            return
+        self.sync()
+        self.file.close()
+        self.file = None
+        if self.npz:
+            table = np.array(self.rows, dtype=self.dtype)
+            # Written under a temporary name and renamed, thus the NPZ file is never partial
+            npz_file = os.path.splitext(self.file_name)[0] + ".npz"
+            with open(npz_file + ".tmp", "wb") as f:
+                np.savez(f, **{name: table[name] for name in self.dtype.names})
+            os.replace(npz_file + ".tmp", npz_file)
@@ -0,0 +1,152 @@
+# Plot widget for scans that grow point by point
+# The scan thread emits every metric (Gain, OP1dB, OIP3, OIP5) after every point,
+# redrawing the whole figure for each of them costs more than the measurement of a point.
+# Here every metric is a persistent curve, a new point only replaces the data of its curve
+# (the thread's results views, no padding), and the frames are drawn at most at the display refresh rate
+# by blitting the curves over the cached background (axes, labels and legend are not redrawn).
+
+import numpy as np
+
+from PyQt6.QtCore       import QTimer
+from PyQt6.QtWidgets    import QWidget, QVBoxLayout
+
+from matplotlib.figure                  import Figure
+from matplotlib.backends.backend_qtagg  import FigureCanvasQTAgg, NavigationToolbar2QT
+
+
+class ScanPlotWidget(QWidget):
+    '''
+    Matplotlib plot widget (same plot() arguments as python_rf_course_utils.qt.PlotWidget)
+    with persistent scan curves:
+        plot_sa.start_scan(f_start, f_stop, xlabel='Frequency (MHz)', ylabel='Power dBm')
+        plot_sa.update_series('Gain', freq, gain, line='k')   # per point, drawn on the next frame
+    :param frame_ms: Minimum time between frames, None - the refresh rate of the screen
+    '''
+    def __init__(self, parent=None, frame_ms=None):
+        super().__init__(parent)
+        self.figure     = Figure()
+        self.canvas     = FigureCanvasQTAgg(self.figure)
+        self.toolbar    = NavigationToolbar2QT(self.canvas, self)
+        layout          = QVBoxLayout(self)
+        layout.addWidget(self.toolbar)
+        layout.addWidget(self.canvas)
+
+        self.ax         = None
+        # Persistent curves, name -> line object
+        self.curves     = {}
+        # Latest data of the curves not drawn yet, name -> (x, y)
+        self.pending    = {}
+        # Figure without the persistent curves (blit background)
+        self.background = None
+        self.canvas.mpl_connect('draw_event', self.on_draw)
+
+        # Frame timer, runs only while there are pending updates
+        self.frame_timer = QTimer(self)
+        self.frame_timer.setInterval(frame_ms if frame_ms is not None else self.refresh_ms())
+        self.frame_timer.timeout.connect(self.render)
+        self.reset_axes()
+
+    def refresh_ms(self) -> int:
+        # Frame period of the display (60 Hz if unknown)
+        screen = self.screen()
+        rate   = screen.refreshRate() if screen is not None else 0.0
+        return max(int(round(1e3/rate)), 1) if rate > 0 else 16
+
+    def reset_axes(self):
+        self.figure.clf()
+        self.ax         = self.figure.add_subplot(111)
+        self.curves     = {}
+        self.pending    = {}
+        self.background = None
+        self.frame_timer.stop()
+
+    def set_background_color(self, color):
+        self.figure.set_facecolor(color)
+        self.canvas.draw_idle()
+
+    def get_y_range(self):
+        return self.ax.get_ylim()
+
+    def plot(self, x, y, line='b-', line_width=1.0, xlabel='', ylabel='', title='', xlog=False, clf=True,
+             legend=None, y_lim_min=None, y_lim_max=None):
+        if clf:
+            self.reset_axes()
+        h_line,     = self.ax.plot(x, y, line, linewidth=line_width, label=legend)
+        if xlog:
+            self.ax.set_xscale('log')
+        self.ax.set_xlabel(xlabel)
+        self.ax.set_ylabel(ylabel)
+        self.ax.set_title(title)
+        self.ax.grid(True)
+        if legend is not None:
+            self.ax.legend()
+        if y_lim_min is not None and y_lim_max is not None:
+            self.ax.set_ylim(y_lim_min, y_lim_max)
+        self.canvas.draw_idle()
+        return h_line
+
+    def start_scan(self, x_start: float, x_stop: float, xlabel='', ylabel='', title=''):
+        '''
+        New empty scan plot, the x axis spans the whole scan (the curves grow into it)
+        '''
+        self.reset_axes()
+        self.ax.set_xlim(x_start, x_stop)
+        self.ax.set_xlabel(xlabel)
+        self.ax.set_ylabel(ylabel)
+        self.ax.set_title(title)
+        self.ax.grid(True)
+        self.canvas.draw_idle()
+
+    def update_series(self, name, x, y, line='b-', line_width=6.0):
+        '''
+        Replace the data of a persistent curve (created on the first call), drawn on the next frame
+        :param name: Curve name (legend)
+        :param x: All the points of the curve so far (not copied, must not change until drawn)
+        '''
+        if name not in self.curves:
+            h_line, = self.ax.plot([], [], line, linewidth=line_width, label=name, animated=True)
+            self.curves[name] = h_line
+            self.ax.legend(loc='lower left')
+            # The legend is part of the background
+            self.background = None
+        self.pending[name] = (x, y)
+        if not self.frame_timer.isActive():
+            self.frame_timer.start()
+
+    def render(self):
+        '''
+        Draw the pending curve updates (frame timer), a full redraw only if the y axis changes
+        '''
+        if not self.pending:
+            self.frame_timer.stop()
+            return
+        for name, (x, y) in self.pending.items():
+            self.curves[name].set_data(x, y)
+        self.pending = {}
+
+        # Rescale the y axis only if the curves left it
+        limits  = self.ax.get_ylim()
+        y_all   = np.concatenate([np.asarray(h_line.get_ydata(), dtype=float) for h_line in self.curves.values()])
+        y_all   = y_all[np.isfinite(y_all)]
+        if len(y_all) and self.ax.get_autoscaley_on():
+            y_lo, y_hi  = limits
+            y_min       = float(y_all.min())
+            y_max       = float(y_all.max())
+            if y_min < y_lo or y_max > y_hi or self.background is None:
+                margin  = max(y_max - y_min, 1.0)*0.1
+                self.ax.set_ylim(y_min - margin, y_max + margin, auto=None)
+        if self.background is None or limits != self.ax.get_ylim():
+            # Axes changed - full redraw (on_draw draws the curves)
+            self.canvas.draw_idle()
+        else:
+            # Blit the curves over the cached background
+            self.canvas.restore_region(self.background)
+            for h_line in self.curves.values():
+                self.ax.draw_artist(h_line)
+            self.canvas.blit(self.figure.bbox)
+
+    def on_draw(self, event):
+        # Cache the background (everything but the persistent curves) and draw the curves on it
+        self.background = self.canvas.copy_from_bbox(self.figure.bbox)
+        for h_line in self.curves.values():
+            self.ax.draw_artist(h_line)
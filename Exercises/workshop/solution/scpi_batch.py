@@ -0,0 +1,163 @@
+# Batching of SCPI commands into a single program message (also used by the ex5 filter scan, ex5_long_process.py)
+# Every write is a network round trip, a scan point sends a dozen of them (e.g. freq, POW:LEV, INIT:IMM).
+# Inside a batch the writes are queued and sent as one message joined with ';' (absolute ':' headers),
+# a query sends the queued writes together with the query, thus a batch costs a single round trip.
+# Optional shadow state - the last value written to each of the listed (cached) headers is kept,
+# writes of an unchanged value are skipped and the matching queries are answered locally.
+
+import re
+
+from contextlib         import contextmanager
+
+import numpy as np
+
+
+def parse_value(arg:str):
+    '''
+    Numeric value of a SCPI argument in base units (e.g. '100 MHz' -> 1e8, '-15 dBm' -> -15, 'ON' -> 1)
+    :return: float, None if the argument is not numeric
+    '''
+    arg = arg.strip().upper()
+    if arg in ('ON', 'OFF'):
+        return float(arg == 'ON')
+    m = re.fullmatch(r'([-+]?[\d.]+(?:E[-+]?\d+)?)\s*(GHZ|MHZ|KHZ|HZ|DBM|DB)?', arg)
+    if m is None:
+        return None
+    return float(m.group(1))*{'GHZ': 1e9, 'MHZ': 1e6, 'KHZ': 1e3}.get(m.group(2), 1.0)
+
+
+class ScpiBatch:
+    '''
+    Wrap an instrument (SCPIWrapper or pyvisa resource) with command batching
+    with scpi.batch():
+        scpi.write("freq 1000 MHz")
+        scpi.write("POW:LEV -10")
+        scpi.query("*OPC?")     # sent as ':freq 1000 MHz;:POW:LEV -10;*OPC?'
+    Outside a batch the writes and queries are passed to the instrument as is.
+    Shadow state - the headers must be spelled as the app writes them (another spelling is an unknown command),
+    the local answer is the value as written (a value the instrument clamps or rejects is not seen).
+    :param cached: Headers of the settings to shadow, e.g. ("POW:LEV", "freq")
+    :param transparent: Headers that do not change the shadowed settings, e.g. ("INIT:IMM", "*OPC?")
+        any other write (and *RST, *RCL) clears the shadow state
+    '''
+    def __init__(self, scpi, max_bytes:int=1024, cached=(), transparent=()):
+        self.scpi       = scpi
+        self.max_bytes  = max_bytes # Input buffer size of the instrument (longest message)
+        self.queue      = None      # Queued commands (None - not in a batch)
+        self.cached     = {self.key(h) for h in cached}
+        self.transparent = {self.key(h) for h in transparent}
+        self.shadow     = {}        # Header -> last value (base units)
+        self.n_skipped  = 0         # Writes and queries that were not sent
+
+    def __getattr__(self, name):
+        # Everything else (e.g. timeout, close) is passed to the instrument
+        return getattr(self.scpi, name)
+
+    @staticmethod
+    def key(header:str) -> str:
+        # Shadow state key of a command header (case and leading ':' do not matter)
+        return header.strip().upper().lstrip(':').rstrip('?')
+
+    def shadowed(self, cmd:str) -> bool:
+        '''Update the shadow state with a write, True if the write does not change it (can be skipped)'''
+        header, _, arg = cmd.strip().partition(' ')
+        key = self.key(header)
+        if key in self.cached:
+            value = parse_value(arg)
+            if value is not None and self.shadow.get(key) == value:
+                return True
+            if value is None:
+                self.shadow.pop(key, None)
+            else:
+                self.shadow[key] = value
+        elif key not in self.transparent or key in ('*RST', '*RCL'):
+            # Reset, recall or an unknown command may change any setting
+            self.shadow.clear()
+        return False
+
+    @staticmethod
+    def join(cmds:list) -> str:
+        # After ';' the header path continues from the previous command, a leading ':' restarts it from the root
+        return ';'.join(c if c.startswith((':', '*')) else ':' + c for c in cmds)
+
+    def write(self, cmd:str):
+        if self.shadowed(cmd):
+            self.n_skipped += 1
+            return None
+        if self.queue is None:
+            return self.scpi.write(cmd)
+        # Send the queue before it overflows the input buffer
+        if self.queue and len(self.join(self.queue + [cmd])) > self.max_bytes:
+            self.flush()
+        self.queue.append(cmd)
+
+    def query(self, cmd:str):
+        key = self.key(cmd)
+        if key in self.shadow:
+            # Answer from the shadow state (reflects the queued writes as well)
+            self.n_skipped += 1
+            return f"{self.shadow[key]:.12g}"
+        if self.queue and len(self.join(self.queue + [cmd])) > self.max_bytes:
+            self.flush()
+        if not self.queue:
+            response = self.scpi.query(cmd)
+        else:
+            # The queued writes and the query in one message (the writes have no response)
+            cmds, self.queue = self.queue + [cmd], []
+            response = self.scpi.query(self.join(cmds))
+        if key in self.cached:
+            value = parse_value(response)
+            if value is not None:
+                self.shadow[key] = value
+        return response
+
+    def query_binary(self, cmd:str) -> np.ndarray:
+        '''
+        Query a REAL,32 little endian block (e.g. the trace data after ':FORM:DATA REAL,32' and ':FORM:BORD SWAP')
+        The queued writes are sent with the query. The block is read by the pyvisa resource
+        (SCPIWrapper keeps it in instr).
+        '''
+        if self.queue and len(self.join(self.queue + [cmd])) > self.max_bytes:
+            self.flush()
+        cmds, self.queue = (self.queue or []) + [cmd], ([] if self.queue is not None else None)
+        resource = getattr(self.scpi, 'instr', self.scpi)
+        return resource.query_binary_values(self.join(cmds), datatype='f', is_big_endian=False, container=np.array)
+
+    def flush(self, opc:bool=False):
+        '''
+        Send the queued commands
+        :param opc: Append *OPC?, wait for the commands to complete
+        :return: The *OPC? response (opc=True), None otherwise
+        '''
+        cmds, self.queue = (self.queue or []), ([] if self.queue is not None else None)
+        try:
+            if opc:
+                return self.scpi.query(self.join(cmds + ["*OPC?"]))
+            if cmds:
+                self.scpi.write(self.join(cmds))
+        except Exception:
+            # The shadow state holds values that may not have been sent
+            self.shadow.clear()
+            raise
+
+    @contextmanager
+    def batch(self, opc:bool=False):
+        '''
+        Queue the writes and send them as a single message at the end of the batch
+        :param opc: End the batch with *OPC? (one completion for the whole batch)
+        '''
+        if self.queue is not None:
+            # Nested batch - part of the outer one
+            yield self
+            return
+        self.queue = []
+        try:
+            yield self
+            self.flush(opc)
+        except BaseException:
+            # The shadow state holds the values of the dropped writes, forget it
+            self.shadow.clear()
+            raise
+        finally:
+            # An exception drops the queued commands
+            self.queue = None
@@ -0,0 +1,325 @@
+# End-to-end acquisition benchmark against the simulated instruments (o400_sim_scpi.py)
+# Drives the acquisition code of the course apps and records the latency of every stage:
+#   write    - SCPI write (program message sent)
+#   query    - SCPI query round trip (excluding trace data)
+#   transfer - trace data transfer (ASCII or REAL,32 block)
+#   parse    - trace data parsing
+#   sweep    - sweep wait of the hi-res scan (LongProcess timing, pipelined - the wait left after the host work)
+#   store    - hi-res segment store/emit (LongProcess timing, includes the plot of a direct connection)
+#   plot     - plot callback including the Qt paint (offscreen)
+# Benchmarks:
+#   refresh_binary/refresh_ascii - live refresh frame (311_main_vsa.py vsa_read_trace and update_curve)
+#   hires_scan                   - Hi-Res snapshot (o310_long_process.py LongProcess.run)
+#   pa_scan                      - PA scan (workshop pa_app_thread.py PaScan.run)
+#   filter_scan                  - Filter scan (ex5 ex5_long_process.py LongProcess.run)
+# The results (p50/p95/p99 and a histogram per stage) are written to a JSON file.
+#
+# Usage: python 401_benchmark.py [baseline.json]
+#   baseline.json - previous results file, the p50 of every stage is compared to it
+# The simulator runs in a separate process, thus its work does not hold the GIL of the benchmark.
+
+import os
+import sys
+import json
+import platform
+import socket
+import subprocess
+
+from time           import perf_counter, sleep, strftime
+
+# Offscreen Qt (no display needed), must be set before the QApplication is created
+os.environ.setdefault("QT_QPA_PLATFORM", "offscreen")
+
+import numpy as np
+import pyvisa
+import yaml
+
+from PyQt6.QtWidgets    import QApplication
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+ROOT = os.path.dirname(HERE)
+sys.path += [os.path.join(ROOT, "Day4", "SpectrumAnalyzer"),
+             os.path.join(ROOT, "Exercises", "workshop", "solution"),
+             os.path.join(ROOT, "Exercises", "ex5", "solution")]
+
+from o310_long_process  import LongProcess, SegmentBuffer, StageTiming
+from o311_vsa_trace     import set_trace_format, TraceReader
+from o312_envelope_plot import EnvelopePlotWidget
+from pa_app_thread      import PaScan
+from scan_plot          import ScanPlotWidget
+from ex5_long_process   import LongProcess as FilterScan
+
+
+class TimedResource:
+    '''
+    Proxy of a pyvisa resource that records the duration of every write and query
+    (the SCPIWrapper methods used by the apps, everything else is passed to the resource)
+    '''
+    def __init__(self, resource, timing: StageTiming):
+        self.resource   = resource
+        self.timing     = timing
+
+    def __getattr__(self, name):
+        return getattr(self.resource, name)
+
+    def write(self, cmd: str):
+        with self.timing.measure('write'):
+            return self.resource.write(cmd)
+
+    def query(self, cmd: str):
+        # ASCII trace data is a transfer, not a query round trip
+        stage = 'transfer' if ':DATA?' in cmd.upper() else 'query'
+        with self.timing.measure(stage):
+            return self.resource.query(cmd)
+
+    def query_binary_values(self, cmd: str, **kwargs):
+        with self.timing.measure('transfer'):
+            return self.resource.query_binary_values(cmd, **kwargs)
+
+
+def stage_stats(durations: list) -> dict:
+    '''Latency statistics (ms) and a log spaced histogram of a stage'''
+    d_ms    = np.asarray(durations)*1e3
+    p50, p95, p99 = np.percentile(d_ms, [50, 95, 99])
+    edges   = np.geomspace(max(d_ms.min(), 1e-3), max(d_ms.max(), 2e-3), 21)
+    counts, _ = np.histogram(np.clip(d_ms, edges[0], edges[-1]), edges)
+    return dict(n=len(d_ms), mean_ms=float(d_ms.mean()), p50_ms=float(p50), p95_ms=float(p95),
+                p99_ms=float(p99), max_ms=float(d_ms.max()),
+                hist=dict(edges_ms=edges.round(4).tolist(), counts=counts.tolist()))
+
+
+class Benchmark:
+    def __init__(self, file_name="bench_defaults.yaml"):
+        with open(os.path.join(HERE, file_name), "r") as f:
+            self.Params     = yaml.safe_load(f)
+        with open(os.path.join(HERE, "sim_defaults.yaml"), "r") as f:
+            self.SimParams  = yaml.safe_load(f)
+        self.app        = QApplication.instance() or QApplication(sys.argv)
+        self.plot_sa    = EnvelopePlotWidget() if self.Params.get('Plot', True) else None
+        if self.plot_sa is not None:
+            self.plot_sa.resize(1000, 600)
+            self.plot_sa.show()
+        self.rm         = pyvisa.ResourceManager('@py')
+        self.server     = None
+        self.sa         = None
+        self.sg         = None
+        self.timing     = StageTiming()
+        self.results    = {}
+
+    # Simulated instruments
+    def start_simulator(self, timeout=10.0):
+        self.server = subprocess.Popen([sys.executable, "o400_sim_scpi.py"], cwd=HERE,
+                                       stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        t_timeout = perf_counter() + timeout
+        while True:
+            try:
+                self.sa = self.open(self.SimParams['PortSA'])
+                self.sg = self.open(self.SimParams['PortSG'])
+                return
+            except (pyvisa.errors.VisaIOError, ConnectionError):
+                if perf_counter() > t_timeout:
+                    raise
+                sleep(0.1)
+
+    def open(self, port: int):
+        resource                    = self.rm.open_resource(f"TCPIP0::127.0.0.1::{port}::SOCKET")
+        resource.read_termination   = '\n'
+        resource.write_termination  = '\n'
+        resource.timeout            = 10000
+        # No Nagle delay of back to back small messages (the VISA default, pyvisa-py leaves it off
+        # and its VI_ATTR_TCPIP_NODELAY setter is not wired, thus it is set on the session socket)
+        self.rm.visalib.sessions[resource.session].interface.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        resource.query("*IDN?")
+        return resource
+
+    def stop_simulator(self):
+        for resource in (self.sa, self.sg):
+            if resource is not None:
+                resource.close()
+        self.rm.close()
+        if self.server is not None:
+            self.server.terminate()
+            self.server.wait()
+
+    def reset(self, span=30.0, rbw=0.1):
+        # Known instrument state before every benchmark (not timed)
+        for resource in (self.sa, self.sg):
+            resource.write("*RST")
+            resource.write("*CLS")
+        self.sa.write(f"sense:FREQuency:SPAN {span} MHz")
+        self.sa.write(f"sense:BANDwidth:RESolution {rbw} MHz")
+        self.sa.query("*OPC?")
+
+    # Plot stage, the callback and the paint it causes
+    def timed_plot(self, plot, *args, **kwargs):
+        with self.timing.measure('plot'):
+            plot(*args, **kwargs)
+            self.app.processEvents()
+
+    def record(self, name: str, t_total: float, extra: StageTiming = None):
+        durations = dict(self.timing.durations)
+        if extra is not None:
+            for stage, d in extra.durations.items():
+                durations.setdefault(stage, []).extend(d)
+        self.results[name] = dict(total_s=t_total,
+                                  stages={stage: stage_stats(d) for stage, d in durations.items()})
+        print(f"{name:<16} {t_total:8.3f} s")
+        for stage, s in self.results[name]['stages'].items():
+            print(f"    {stage:<10}: {s['n']:6d} x  p50 {s['p50_ms']:8.3f}  p95 {s['p95_ms']:8.3f}  "
+                  f"p99 {s['p99_ms']:8.3f} ms")
+        self.timing = StageTiming()
+
+    # Benchmarks
+    def bench_refresh(self, binary: bool):
+        self.reset()
+        vsa         = TimedResource(self.sa, self.timing)
+        binary      = set_trace_format(vsa, binary)
+        vsa.write(":INITiate:CONTinuous ON")
+        self.timing = StageTiming()
+        vsa.timing  = self.timing
+        # The trace read of the app (vsa_read_trace)
+        reader      = TraceReader(vsa, binary, timing=self.timing)
+        if self.plot_sa is not None:
+            self.plot_sa.reset_axes()
+        t_start     = perf_counter()
+        for _ in range(self.Params.get('RefreshFrames', 200)):
+            # vsa_read_trace
+            p, freq_axis = reader.read()
+            # timer_refresh_plot
+            if self.plot_sa is not None:
+                self.timed_plot(self.plot_sa.update_curve, 'PSA', freq_axis, p,
+                                line='b-', line_width=4.0, xlabel='Frequency (MHz)', ylabel='Power dBm',
+                                title='PSA', xlog=False, clf=True)
+        self.record(f"refresh_{'binary' if binary else 'ascii'}", perf_counter() - t_start)
+
+    def bench_hires(self):
+        self.reset()
+        self.sa.write(":INITiate:CONTinuous ON")
+        self.timing = StageTiming()
+        thread      = LongProcess(TimedResource(self.sa, self.timing), binary=True,
+                                  pipelined=self.Params.get('HiResPipelined', True),
+                                  stream=self.Params.get('HiResStream', True))
+        plot_kwargs = dict(line='b-', line_width=4.0, xlabel='Frequency (MHz)', ylabel='Power dBm',
+                           title='Hi-Res PSA', xlog=False)
+        if self.plot_sa is not None:
+            thread.data.connect(lambda freq, power:
+                                self.timed_plot(self.plot_sa.plot, freq, power, clf=True, **plot_kwargs))
+            # 311_main_vsa.py cb_hi_res_segment (the buffer is redrawn at the default refresh rate)
+            buffer  = []
+            def cb_segment(offset, freq, power):
+                if offset == 0:
+                    buffer[:] = [SegmentBuffer(thread.scan_freq(), self.Params.get('HiResRefresh', 0.25))]
+                if buffer[0].fill(offset, power):
+                    self.timed_plot(self.plot_sa.update_curve, 'HiRes', buffer[0].freq, buffer[0].power,
+                                    clf=True, **plot_kwargs)
+            thread.segment.connect(cb_segment)
+        t_start     = perf_counter()
+        # Run in this thread (the signals call the plot directly)
+        thread.run()
+        # The scan measures its own transfer, the proxy measures it as well
+        thread.timing.durations.pop('transfer', None)
+        thread.timing.durations.pop('configure', None)
+        self.record("hires_scan", perf_counter() - t_start, thread.timing)
+
+    def bench_pa_scan(self):
+        self.reset(span=self.SimParams['ToneSpacing']*5.0 + 2.0, rbw=self.SimParams['ToneSpacing']/8.0)
+        self.sg.write(f":POW:LEV {self.Params.get('PaPtx', -15.0)} dBm")
+        self.timing = StageTiming()
+        f_scan      = np.linspace(self.Params.get('PaFstart', 100.0), self.Params.get('PaFstop', 2100.0),
+                                  self.Params.get('PaPoints', 5))
+        thread      = PaScan(f_scan=f_scan, scpi_sa=TimedResource(self.sa, self.timing),
+                             scpi_sg=TimedResource(self.sg, self.timing), loss=self.SimParams['Loss'],
+                             concurrent=self.Params.get('PaConcurrent', True),
+                             model_op1db=self.Params.get('PaModelOP1dB', True),
+                             trace_imd=self.Params.get('PaTraceIMD', True))
+
+        # pa_app_solution.py tcb_plot
+        incremental = self.Params.get('PaIncrementalPlot', True)
+        plot_scan   = None
+        if self.plot_sa is not None and incremental:
+            plot_scan = ScanPlotWidget()
+            plot_scan.resize(1000, 600)
+            plot_scan.show()
+            plot_scan.start_scan(f_scan[0], f_scan[-1], xlabel='Frequency (MHz)', ylabel='Power dBm',
+                                 title='Filter response')
+
+        def tcb_plot(freq, power, clf=True, legend='Gain', color='b-'):
+            if incremental:
+                plot_scan.update_series(legend, freq, power, line=color, line_width=6.0)
+                return
+            power_v = np.concatenate((power, np.ones(len(f_scan) - len(power))*power[0]))
+            self.plot_sa.plot(f_scan, power_v, line=color, line_width=6.0, xlabel='Frequency (MHz)',
+                              ylabel='Power dBm', title='Filter response', xlog=False, clf=clf, legend=legend)
+        if self.plot_sa is not None:
+            thread.data.connect(lambda *args: self.timed_plot(tcb_plot, *args))
+        t_start     = perf_counter()
+        thread.run()
+        if plot_scan is not None:
+            # The last frame
+            self.timed_plot(plot_scan.render)
+            plot_scan.close()
+        self.record("pa_scan", perf_counter() - t_start)
+
+    def bench_filter_scan(self):
+        self.reset()
+        self.sg.write(f":POW:LEV {self.Params.get('FilterPout', -30.0)} dBm")
+        self.timing = StageTiming()
+        f_scan      = np.linspace(self.Params.get('FilterFstart', 850.0), self.Params.get('FilterFstop', 950.0),
+                                  self.Params.get('FilterPoints', 41))
+        thread      = FilterScan(f_scan=f_scan, scpi_sa=TimedResource(self.sa, self.timing),
+                                 scpi_sg=TimedResource(self.sg, self.timing))
+
+        # Ex5_solution.py tcb_plot
+        def tcb_plot(freq, power):
+            power_v = np.concatenate((power, np.ones(len(f_scan) - len(power))*-100))
+            self.plot_sa.plot(f_scan, power_v, line='b-', line_width=1.5, xlabel='Frequency (MHz)',
+                              ylabel='Power dBm', title='Filter response', xlog=False, clf=True)
+        if self.plot_sa is not None:
+            thread.data.connect(lambda *args: self.timed_plot(tcb_plot, *args))
+        t_start     = perf_counter()
+        thread.run()
+        self.record("filter_scan", perf_counter() - t_start)
+
+    def run(self):
+        self.start_simulator()
+        try:
+            self.bench_refresh(binary=True)
+            self.bench_refresh(binary=False)
+            self.bench_hires()
+            self.bench_pa_scan()
+            self.bench_filter_scan()
+        finally:
+            self.stop_simulator()
+
+    def save(self, file_name: str = None):
+        if file_name is None:
+            file_name = self.Params.get('Output') or f"bench_{strftime('%Y%m%d_%H%M%S')}.json"
+        meta = dict(date=strftime('%Y-%m-%d %H:%M:%S'), python=platform.python_version(),
+                    numpy=np.__version__, pyvisa=pyvisa.__version__, platform=platform.platform(),
+                    params=self.Params, sim_params=self.SimParams)
+        with open(file_name, "w") as f:
+            json.dump(dict(meta=meta, benchmarks=self.results), f, indent=2)
+        print(f"Results saved to {file_name}")
+        return file_name
+
+
+def compare(results: dict, baseline: dict):
+    '''Print the p50 of every stage relative to a baseline results file'''
+    print("p50 relative to the baseline (new/old)")
+    for name, bench in results.items():
+        if name not in baseline['benchmarks']:
+            continue
+        old = baseline['benchmarks'][name]
+        print(f"{name:<16} total {bench['total_s']/old['total_s']:6.2f}")
+        for stage, s in bench['stages'].items():
+            if stage in old['stages']:
+                print(f"    {stage:<10}: {s['p50_ms']/old['stages'][stage]['p50_ms']:6.2f}")
+
+
+if __name__ == "__main__":
+    benchmark = Benchmark()
+    benchmark.run()
+    benchmark.save()
+    if len(sys.argv) > 1:
+        with open(sys.argv[1], "r") as f:
+            compare(benchmark.results, json.load(f))
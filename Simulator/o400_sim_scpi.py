@@ -0,0 +1,551 @@
+# Simulated SCPI instruments (spectrum analyzer and signal generator) over a raw socket
+# Stand-in for the lab instruments, thus the acquisition code can be benchmarked and tested without hardware.
+# Connect with pyvisa to 'TCPIP0::127.0.0.1::5025::SOCKET' (read/write termination '\n').
+#
+# The bench model: SG -> PA (DUT) -> attenuator (Loss) -> SA
+# - SG: frequency, power, RF on/off, modulation on/off (modulation on - two tones spaced by ToneSpacing)
+# - PA: Rapp AM/AM compression (Gain, OP1dB) and IM3/IM5 products (OIP3, OIP5)
+# - SA: swept spectrum of the PA output and static tones, sweep time modeled from span/RBW^2
+
+import re
+import socketserver
+import threading
+import time
+
+import numpy as np
+import yaml
+
+
+def scpi_regex(pattern: str) -> re.Pattern:
+    '''
+    Convert a SCPI command pattern to a regular expression of the (uppercase) header.
+    [NODE] - optional node, lower case letters - optional (long form), # - numeric suffix
+    e.g. '[:SENSe]:FREQuency:CENTer' matches 'FREQ:CENT', ':SENS:FREQuency:CENTER'
+    '''
+    regex = ''
+    for optional, mnemonic, suffix in re.findall(r'(\[?):?([A-Za-z*]+)(#?)\]?', pattern):
+        short = re.match(r'[A-Z*]*', mnemonic).group()
+        rest  = mnemonic[len(short):].upper()
+        # Any prefix of the long form is accepted (e.g. DETE for DETector)
+        node  = re.escape(short) + ''.join(f'(?:{c}' for c in rest) + ')?'*len(rest)
+        node  = ':' + node + (r'(\d*)' if suffix else '')
+        regex += f'(?:{node})?' if optional else node
+    return re.compile(regex + r'$')
+
+
+def parse_value(arg: str) -> float:
+    '''Parse a numeric SCPI argument with an optional unit (e.g. '100 MHz', '-15 dBm', 'ON')'''
+    arg = arg.strip().upper()
+    if arg in ('ON', 'OFF'):
+        return float(arg == 'ON')
+    m = re.match(r'([-+]?[\d.]+(?:E[-+]?\d+)?)\s*(GHZ|MHZ|KHZ|HZ|DBM|DB|S|MS|US)?$', arg)
+    if m is None:
+        raise ValueError(arg)
+    scale = {'GHZ': 1e9, 'MHZ': 1e6, 'KHZ': 1e3, 'MS': 1e-3, 'US': 1e-6}.get(m.group(2), 1.0)
+    return float(m.group(1)) * scale
+
+
+def split_commands(line: str) -> list:
+    '''Split a program message into its commands (';' separated, quoted strings are kept)'''
+    return [c.strip() for c in re.findall(r'(?:[^;"]|"[^"]*")+', line) if c.strip()]
+
+
+class SimInstrument:
+    '''
+    Base class of the simulated instruments - IEEE 488.2 common commands, error queue and command table.
+    Subclasses fill self.commands with (pattern, handler) pairs, handler(args, is_query, suffixes).
+    '''
+    idn = "Simulated,Instrument,SIM0000,1.0"
+
+    def __init__(self):
+        self.lock       = threading.RLock()
+        self.errors     = []        # Error queue (code, message)
+        self.esr        = 0         # Standard event status register
+        self.opc_armed  = False     # *OPC was sent, set the OPC bit when the pending operation completes
+        self.registers  = {}        # *SAV/*RCL registers
+        self.state      = {}
+        self.commands   = []
+        self.reset()
+
+    # Table of the commands (compiled patterns)
+    def add_commands(self, table: list):
+        self.commands += [(scpi_regex(pattern), handler) for pattern, handler in table]
+
+    def reset(self):
+        self.state      = self.default_state()
+
+    def default_state(self) -> dict:
+        return {}
+
+    def busy_until(self) -> float:
+        # Time (perf_counter) the pending operation completes
+        return 0.0
+
+    def push_error(self, code: int, msg: str):
+        self.errors.append((code, msg))
+        # Command error (bit 5) or execution error (bit 4)
+        self.esr |= 32 if code <= -100 and code > -200 else 16
+
+    def update_opc(self):
+        if self.opc_armed and time.perf_counter() >= self.busy_until():
+            self.esr |= 1
+            self.opc_armed = False
+
+    def common(self, header: str, args: str):
+        # IEEE 488.2 common commands
+        if header == '*IDN?':
+            return self.idn
+        if header == '*RST':
+            self.reset()
+        elif header == '*CLS':
+            self.errors.clear()
+            self.esr        = 0
+            self.opc_armed  = False
+        elif header == '*OPC?':
+            # Block until the pending operation completes
+            t_wait = self.busy_until() - time.perf_counter()
+            if t_wait > 0:
+                time.sleep(t_wait)
+            return '1'
+        elif header == '*OPC':
+            self.opc_armed = True
+        elif header == '*WAI':
+            t_wait = self.busy_until() - time.perf_counter()
+            if t_wait > 0:
+                time.sleep(t_wait)
+        elif header == '*ESR?':
+            self.update_opc()
+            esr, self.esr = self.esr, 0
+            return str(esr)
+        elif header == '*SAV':
+            self.registers[int(args)] = dict(self.state)
+        elif header == '*RCL':
+            if int(args) in self.registers:
+                self.state = dict(self.registers[int(args)])
+            else:
+                self.push_error(-200, f"Execution error;*RCL {args}")
+        else:
+            self.push_error(-113, f"Undefined header;{header}")
+        return None
+
+    def execute(self, cmd: str):
+        '''Execute a single command, return the response (str, bytes or None)'''
+        header, _, args = cmd.strip().partition(' ')
+        header  = header.upper()
+        args    = args.strip()
+        with self.lock:
+            if header.startswith('*'):
+                return self.common(header, args)
+            is_query = header.endswith('?')
+            header   = ':' + header.rstrip('?').lstrip(':')
+            for regex, handler in self.commands:
+                m = regex.match(header)
+                if m is not None:
+                    try:
+                        return handler(args, is_query, [int(s) for s in m.groups() if s])
+                    except (ValueError, IndexError, KeyError, StopIteration):
+                        self.push_error(-224, f"Illegal parameter value;{cmd}")
+                        return None
+            self.push_error(-113, f"Undefined header;{cmd}")
+            return None
+
+    def execute_line(self, line: str):
+        '''Execute a program message, return the response message (bytes) or None'''
+        responses = []
+        for cmd in split_commands(line):
+            r = self.execute(cmd)
+            if r is not None:
+                responses.append(r if isinstance(r, bytes) else str(r).encode())
+        if not responses:
+            return None
+        return b';'.join(responses) + b'\n'
+
+    def syst_err(self, args, is_query, suffixes):
+        if not self.errors:
+            return '+0,"No error"'
+        code, msg = self.errors.pop(0)
+        return f'{code:+d},"{msg}"'
+
+    @staticmethod
+    def fmt(value: float) -> str:
+        return f"{value:+.11E}"
+
+
+class SimBench:
+    '''Signal generator -> PA -> attenuator -> spectrum analyzer model'''
+    def __init__(self, params: dict):
+        self.params     = params
+        self.sg         = None
+
+    def rapp(self, p_in_dbm):
+        # Rapp AM/AM (power form) with the output 1 dB compression point OP1dB
+        pa      = self.params['PA']
+        p       = pa['Smoothness']
+        x       = 10**((np.asarray(p_in_dbm) + pa['Gain'])/10)  # Linear (uncompressed) output power mW
+        op1db   = 10**(pa['OP1dB']/10)
+        p_sat   = op1db * 10**0.1 / (10**(0.1*p) - 1)**(1/p)
+        return 10*np.log10(x / (1 + (x/p_sat)**p)**(1/p))
+
+    def tones(self) -> list:
+        '''(frequency Hz, power dBm) of the tones at the SA input'''
+        tones   = [(t['F']*1e6, t['P']) for t in self.params.get('Tones', []) or []]
+        sg      = self.sg
+        if sg is None or not sg.state['rf_on']:
+            return tones
+        pa      = self.params['PA']
+        loss    = self.params['Loss']
+        f0      = sg.state['freq']
+        p_tx    = sg.state['power']
+        if not sg.state['mod_on']:
+            # CW
+            tones.append((f0, float(self.rapp(p_tx)) - loss))
+            return tones
+        # Two tones (total power p_tx) and the intermodulation products
+        fd      = self.params['ToneSpacing']*1e6
+        p_tone  = float(self.rapp(p_tx)) - 3.0                          # Output power per tone
+        p_im3   = 3*p_tone - 2*pa['OIP3']
+        p_im5   = 5*p_tone - 4*pa['OIP5']
+        for k, p in ((1, p_tone), (3, p_im3), (5, p_im5)):
+            tones.append((f0 - k*fd/2, p - loss))
+            tones.append((f0 + k*fd/2, p - loss))
+        return tones
+
+
+class SimSpectrumAnalyzer(SimInstrument):
+    idn = "Simulated,N9000B,SIM0001,A.01.00"
+
+    trace_types = ["WRIT", "AVER", "MAXH", "MINH", "VIEW", "BLAN"]
+    detectors   = ["AVER", "NORM", "SAMP", "POS", "NEG", "QPEAK", "EAV", "RAV"]
+
+    def __init__(self, bench: SimBench):
+        self.bench      = bench
+        self.sweep_end  = 0.0       # Time (perf_counter) the current single sweep completes
+        self.binary     = False     # Trace format REAL,32
+        self.swapped    = False     # Byte order swapped (little endian)
+        self.trace      = None      # Last trace (hold modes and markers)
+        self.pending    = False     # Single sweep in progress, the trace is taken at the end of the sweep
+        self.marker     = 0         # Marker bin
+        self.rng        = np.random.default_rng()
+        super().__init__()
+        self.add_commands([
+            ('[:SENSe]:FREQuency:CENTer',               self.cmd_fc         ),
+            ('[:SENSe]:FREQuency:SPAN',                 self.cmd_span       ),
+            ('[:SENSe]:FREQuency:STARt',                self.cmd_start      ),
+            ('[:SENSe]:FREQuency:STOP',                 self.cmd_stop       ),
+            ('[:SENSe]:BANDwidth[:RESolution]',         self.cmd_rbw        ),
+            ('[:SENSe]:BWIDth[:RESolution]',            self.cmd_rbw        ),
+            ('[:SENSe]:SWEep:POINts',                   self.cmd_points     ),
+            ('[:SENSe]:SWEep:TIME',                     self.cmd_sweep_time ),
+            ('[:SENSe]:DETector[:TRACe#]',              self.cmd_detector   ),
+            ('[:SENSe]:DETector[:FUNCtion]',            self.cmd_detector   ),
+            (':INITiate:CONTinuous',                    self.cmd_cont       ),
+            (':INITiate[:IMMediate]',                   self.cmd_init       ),
+            (':ABORt',                                  self.cmd_abort      ),
+            (':TRACe#:TYPE',                            self.cmd_trace_type ),
+            (':TRACe#:MODE',                            self.cmd_trace_type ),
+            (':TRACe[:DATA]',                           self.cmd_trace_data ),
+            (':DISPlay:WINDow#:TRACe:Y[:SCALe]:RLEVel', self.cmd_rlev       ),
+            (':DISPlay:WINDow#:TRACe:Y[:SCALe]:PDIVision', self.cmd_pdiv    ),
+            (':FORMat[:TRACe][:DATA]',                  self.cmd_format     ),
+            (':FORMat:BORDer',                          self.cmd_border     ),
+            (':CALCulate:MARKer#:MAXimum:NEXT',         self.cmd_marker_next),
+            (':CALCulate:MARKer#:MAXimum[:PEAK]',       self.cmd_marker_max ),
+            (':CALCulate:MARKer#:X',                    self.cmd_marker_x   ),
+            (':CALCulate:MARKer#:Y',                    self.cmd_marker_y   ),
+            (':STATus:OPERation:CONDition',             self.cmd_oper_cond  ),
+            (':SYSTem:ERRor[:NEXT]',                    self.syst_err       )])
+
+    def default_state(self) -> dict:
+        return dict(fc=1e9, span=30e6, rbw=1e6, points=1001, cont=True, trace_type=0, detector=0,
+                    rlev=0.0, pdiv=10.0)
+
+    def reset(self):
+        super().reset()
+        self.binary     = False
+        self.swapped    = False
+        self.trace      = None
+        self.pending    = False
+        self.sweep_end  = 0.0
+
+    def busy_until(self) -> float:
+        return self.sweep_end
+
+    # Sweep time model (swept analyzer), k * span / RBW^2
+    def sweep_time(self) -> float:
+        s = self.state
+        return max(2.0 * s['span'] / s['rbw']**2, 1e-3)
+
+    def freq_axis(self) -> np.ndarray:
+        s = self.state
+        return np.linspace(s['fc'] - s['span']/2, s['fc'] + s['span']/2, s['points'])
+
+    def sweep(self) -> np.ndarray:
+        '''Synthesize a trace of the current settings'''
+        s       = self.state
+        f       = self.freq_axis()
+        rbw     = s['rbw']
+        # Noise floor (DANL dBm/Hz in the RBW) with the detector statistics
+        danl    = self.bench.params['DANL'] + 10*np.log10(rbw)
+        noise   = self.rng.exponential(size=len(f))
+        if self.detectors[s['detector']] in ("AVER", "RAV", "EAV"):
+            noise = 0.5 + 0.5*noise
+        p_lin   = 10**(danl/10) * noise
+        # Tones through a Gaussian RBW filter, a tone between two bins is caught by the nearest bin
+        bin_width = s['span'] / max(s['points'] - 1, 1)
+        for f_tone, p_tone in self.bench.tones():
+            df      = np.maximum(np.abs(f - f_tone) - bin_width/2, 0)
+            near    = df < 10*rbw
+            p_lin[near] += 10**(p_tone/10) * np.exp(-4*np.log(2)*(df[near]/rbw)**2)
+        trace   = (10*np.log10(p_lin)).astype(np.float32)
+
+        # Trace hold modes
+        mode    = self.trace_types[s['trace_type']]
+        if self.trace is not None and len(self.trace) == len(trace):
+            if mode == "MAXH":
+                trace = np.maximum(trace, self.trace)
+            elif mode == "MINH":
+                trace = np.minimum(trace, self.trace)
+            elif mode == "AVER":
+                trace = (0.9*self.trace + 0.1*trace).astype(np.float32)
+        self.trace = trace
+        return trace
+
+    def current_trace(self) -> np.ndarray:
+        if self.pending:
+            # The signals are seen during the sweep, e.g. an SG change sent right before INIT:IMM is swept
+            t_wait = self.sweep_end - time.perf_counter()
+            if t_wait > 0:
+                time.sleep(t_wait)
+            self.pending = False
+            return self.sweep()
+        if self.trace is None or len(self.trace) != self.state['points']:
+            return self.sweep()
+        return self.trace
+
+    def set_or_query(self, key, args, is_query, scale=1.0, fmt=None):
+        if is_query:
+            return (fmt or self.fmt)(self.state[key]/scale)
+        self.state[key] = parse_value(args)*scale
+        self.trace      = None
+        return None
+
+    def cmd_fc(self, args, is_query, suffixes):
+        return self.set_or_query('fc', args, is_query)
+
+    def cmd_span(self, args, is_query, suffixes):
+        return self.set_or_query('span', args, is_query)
+
+    def cmd_start(self, args, is_query, suffixes):
+        if is_query:
+            return self.fmt(self.state['fc'] - self.state['span']/2)
+        stop = self.state['fc'] + self.state['span']/2
+        start = parse_value(args)
+        self.state['fc'], self.state['span'] = (start + stop)/2, stop - start
+
+    def cmd_stop(self, args, is_query, suffixes):
+        if is_query:
+            return self.fmt(self.state['fc'] + self.state['span']/2)
+        start = self.state['fc'] - self.state['span']/2
+        stop = parse_value(args)
+        self.state['fc'], self.state['span'] = (start + stop)/2, stop - start
+
+    def cmd_rbw(self, args, is_query, suffixes):
+        return self.set_or_query('rbw', args, is_query)
+
+    def cmd_points(self, args, is_query, suffixes):
+        if is_query:
+            return str(self.state['points'])
+        self.state['points'] = int(parse_value(args))
+
+    def cmd_sweep_time(self, args, is_query, suffixes):
+        if is_query:
+            return self.fmt(self.sweep_time())
+
+    def cmd_detector(self, args, is_query, suffixes):
+        if is_query:
+            return self.detectors[self.state['detector']]
+        name = args.upper()
+        self.state['detector'] = next(i for i, d in enumerate(self.detectors) if name.startswith(d[:3]))
+
+    def cmd_cont(self, args, is_query, suffixes):
+        if is_query:
+            return str(int(self.state['cont']))
+        self.state['cont'] = bool(parse_value(args))
+
+    def cmd_init(self, args, is_query, suffixes):
+        # Start a single sweep (completes after the sweep time)
+        self.sweep_end  = time.perf_counter() + self.sweep_time()
+        self.pending    = True
+
+    def cmd_abort(self, args, is_query, suffixes):
+        self.sweep_end  = 0.0
+        self.pending    = False
+
+    def cmd_trace_type(self, args, is_query, suffixes):
+        if is_query:
+            return self.trace_types[self.state['trace_type']]
+        name = args.upper()
+        self.state['trace_type'] = 0 if name.startswith("CLE") else \
+            next(i for i, t in enumerate(self.trace_types) if name.startswith(t))
+        self.trace = None
+
+    def cmd_trace_data(self, args, is_query, suffixes):
+        if not is_query:
+            raise ValueError(args)
+        if self.state['cont']:
+            # Continuous sweep - every read returns a new trace
+            trace = self.sweep()
+        else:
+            # Single sweep - the trace of the last sweep (waits for it to complete)
+            trace = self.current_trace()
+        if self.binary:
+            data = trace.astype('<f4' if self.swapped else '>f4').tobytes()
+            return f"#{len(str(len(data)))}{len(data)}".encode() + data
+        return ','.join(f"{v:.3f}" for v in trace)
+
+    def cmd_rlev(self, args, is_query, suffixes):
+        return self.set_or_query('rlev', args, is_query)
+
+    def cmd_pdiv(self, args, is_query, suffixes):
+        return self.set_or_query('pdiv', args, is_query)
+
+    def cmd_format(self, args, is_query, suffixes):
+        if is_query:
+            return "REAL,32" if self.binary else "ASC,8"
+        fmt = args.upper().replace(' ', '')
+        if fmt.startswith("REAL"):
+            self.binary = True
+        elif fmt.startswith("ASC"):
+            self.binary = False
+        else:
+            raise ValueError(args)
+
+    def cmd_border(self, args, is_query, suffixes):
+        if is_query:
+            return "SWAP" if self.swapped else "NORM"
+        self.swapped = args.upper().startswith("SWAP")
+
+    def cmd_marker_max(self, args, is_query, suffixes):
+        self.marker = int(np.argmax(self.current_trace()))
+
+    def cmd_marker_next(self, args, is_query, suffixes):
+        # Next peak (local maximum) of the trace not higher than the marker, equal tones are separate peaks
+        y       = self.current_trace()
+        peaks   = np.flatnonzero((y[1:-1] > y[:-2]) & (y[1:-1] >= y[2:])) + 1
+        peaks   = peaks[(y[peaks] <= y[self.marker]) & (peaks != self.marker)]
+        if len(peaks):
+            self.marker = int(peaks[np.argmax(y[peaks])])
+
+    def cmd_marker_x(self, args, is_query, suffixes):
+        f = self.freq_axis()
+        if is_query:
+            return self.fmt(f[self.marker])
+        self.marker = int(np.argmin(np.abs(f - parse_value(args))))
+
+    def cmd_marker_y(self, args, is_query, suffixes):
+        if is_query:
+            return self.fmt(float(self.current_trace()[self.marker]))
+
+    def cmd_oper_cond(self, args, is_query, suffixes):
+        # Bit 3 - sweeping
+        if is_query:
+            return str(8 if self.state['cont'] or time.perf_counter() < self.sweep_end else 0)
+
+
+class SimSignalGenerator(SimInstrument):
+    idn = "Simulated,N5182B,SIM0002,B.01.00"
+
+    def __init__(self, bench: SimBench):
+        self.bench = bench
+        super().__init__()
+        self.add_commands([
+            ('[:SOURce]:FREQuency[:CW]',                self.cmd_freq       ),
+            ('[:SOURce]:POWer[:LEVel][:IMMediate][:AMPLitude]', self.cmd_power),
+            (':OUTPut:MODulation[:STATe]',              self.cmd_mod        ),
+            (':OUTPut[:STATe]',                         self.cmd_rf         ),
+            (':SYSTem:ERRor[:NEXT]',                    self.syst_err       )])
+
+    def default_state(self) -> dict:
+        return dict(freq=1e9, power=-135.0, rf_on=False, mod_on=False)
+
+    def cmd_freq(self, args, is_query, suffixes):
+        if is_query:
+            return self.fmt(self.state['freq'])
+        self.state['freq'] = parse_value(args)
+
+    def cmd_power(self, args, is_query, suffixes):
+        if is_query:
+            return self.fmt(self.state['power'])
+        self.state['power'] = parse_value(args)
+
+    def cmd_rf(self, args, is_query, suffixes):
+        if is_query:
+            return str(int(self.state['rf_on']))
+        self.state['rf_on'] = bool(parse_value(args))
+
+    def cmd_mod(self, args, is_query, suffixes):
+        if is_query:
+            return str(int(self.state['mod_on']))
+        self.state['mod_on'] = bool(parse_value(args))
+
+
+class ScpiHandler(socketserver.StreamRequestHandler):
+    # Raw socket (port 5025 style) - one program message per line
+    def handle(self):
+        instrument  = self.server.instrument
+        latency     = self.server.latency
+        for line in self.rfile:
+            line = line.decode(errors='replace').strip()
+            if not line:
+                continue
+            if latency > 0:
+                time.sleep(latency)
+            response = instrument.execute_line(line)
+            if response is not None:
+                self.wfile.write(response)
+                self.wfile.flush()
+
+
+class ScpiServer(socketserver.ThreadingTCPServer):
+    daemon_threads      = True
+    allow_reuse_address = True
+
+    def __init__(self, instrument: SimInstrument, host: str = '127.0.0.1', port: int = 5025, latency: float = 0.0):
+        super().__init__((host, port), ScpiHandler)
+        self.instrument = instrument
+        self.latency    = latency   # Simulated network/parser latency per program message (sec)
+
+    def start(self):
+        # Serve in a background thread
+        thread = threading.Thread(target=self.serve_forever, daemon=True)
+        thread.start()
+        return self
+
+
+def start_bench(file_name: str = "sim_defaults.yaml", host: str = '127.0.0.1', params: dict = None):
+    '''
+    Start the simulated spectrum analyzer and signal generator servers
+    :return: sa_server, sg_server (the instruments are server.instrument)
+    '''
+    if params is None:
+        with open(file_name, "r") as f:
+            params = yaml.safe_load(f)
+    bench       = SimBench(params)
+    sa          = SimSpectrumAnalyzer(bench)
+    sg          = SimSignalGenerator(bench)
+    bench.sg    = sg
+    sa_server   = ScpiServer(sa, host, params['PortSA'], params['Latency']).start()
+    sg_server   = ScpiServer(sg, host, params['PortSG'], params['Latency']).start()
+    return sa_server, sg_server
+
+
+if __name__ == '__main__':
+    sa_server, sg_server = start_bench()
+    print(f"Simulated SA: TCPIP0::127.0.0.1::{sa_server.server_address[1]}::SOCKET")
+    print(f"Simulated SG: TCPIP0::127.0.0.1::{sg_server.server_address[1]}::SOCKET")
+    try:
+        while True:
+            time.sleep(1)
+    except KeyboardInterrupt:
+        sa_server.shutdown()
+        sg_server.shutdown()